@@ -87,7 +87,7 @@ def _default_jupyter_callback(attack, head = 6, fmt="{:02X}<br>{:.3f}"):
                 print("bnum: {}, key: {}".format(bnum, key))
         return ret
     attack_results.set_known_key(key)
-    stat_data = attack_results.find_maximums()
+    stat_data = attack_results.find_maximums(top_k=head)
     df = pd.DataFrame(stat_data).transpose()
 
     #Add PGE row
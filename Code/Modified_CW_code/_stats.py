@@ -33,16 +33,127 @@ from collections import OrderedDict
 #This code must substitute the existing _stats.py within said directory 
 
 
+class RankHistory(object):
+    """
+    Evolution of the key ranking during an attack, one row per trace count.
+
+    For every subkey byte it keeps the PGE (rank of the known key) and the
+    top_k best guesses with their correlation and its location (the maxima of
+    every trace count, bounded to top_k guesses). Results.find_maximums() records
+    each byte once per trace count, so calling it again (e.g. from callbacks
+    or plots) overwrites the row instead of adding one. The arrays are
+    preallocated and doubled when full.
+    """
+
+    def __init__(self, numSubkeys=16, numPerms=256, top_k=6, capacity=64):
+        self.numSubkeys = numSubkeys
+        self.numPerms = numPerms
+        self.top_k = min(top_k, numPerms)
+        self.count = 0
+        self._rows = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        trace = np.zeros(capacity, dtype=np.int64)
+        pge = np.full((capacity, self.numSubkeys), -1, dtype=np.int16)
+        hyp = np.full((capacity, self.numSubkeys, self.top_k), -1, dtype=np.int16)
+        point = np.zeros((capacity, self.numSubkeys, self.top_k), dtype=np.int32)
+        value = np.full((capacity, self.numSubkeys, self.top_k), np.nan)
+        if self.count > 0:
+            n = self.count
+            (trace[:n], pge[:n], hyp[:n], point[:n], value[:n]) = \
+                (self.trace[:n], self.pge[:n], self.hyp[:n], self.point[:n], self.value[:n])
+        (self.trace, self.pge, self.hyp, self.point, self.value) = (trace, pge, hyp, point, value)
+
+    def record(self, bnum, tnum, pge, maxes):
+        """ Store the ranking of subkey bnum after tnum traces
+
+        Args:
+            bnum (int): The index of the subkey.
+            tnum (int): Number of traces, None if unknown.
+            pge (int): Partial guessing entropy of the subkey.
+            maxes: Maxima of the subkey, as in Results.maxes, with at least
+                the top_k first ones sorted.
+        """
+        tnum = -1 if tnum is None else int(tnum)
+        row = self._rows.get(tnum)
+        if row is None:
+            if self.count == len(self.trace):
+                self._allocate(2 * len(self.trace))
+            row = self._rows[tnum] = self.count
+            self.trace[row] = tnum
+            self.count += 1
+        self.pge[row, bnum] = pge
+        self.hyp[row, bnum] = maxes['hyp'][:self.top_k]
+        self.point[row, bnum] = maxes['point'][:self.top_k]
+        self.value[row, bnum] = maxes['value'][:self.top_k]
+
+    def arrays(self):
+        """ Get the recorded rows, ordered by trace count
+
+        Returns:
+            dict with 'trace' (rows), 'pge' (rows x subkeys, -1 where the
+            subkey was not recorded), 'hyp', 'point' and 'value' (rows x
+            subkeys x top_k, best guess first).
+        """
+        order = np.argsort(self.trace[:self.count], kind='stable')
+        return {'trace': self.trace[order], 'pge': self.pge[order],
+                'hyp': self.hyp[order], 'point': self.point[order], 'value': self.value[order]}
+
+    def guessing_entropy(self):
+        """ Get the PGE averaged over the subkeys, for every trace count
+
+        Returns:
+            (trace counts, average PGE) numpy arrays
+        """
+        arr = self.arrays()
+        pge = np.where(arr['pge'] < 0, np.nan, arr['pge'])
+        return arr['trace'], np.nanmean(pge, axis=1)
+
+    def success_rate(self, order=1):
+        """ Get the fraction of subkeys whose known key is among the order best guesses
+
+        Returns:
+            (trace counts, success rate) numpy arrays
+        """
+        arr = self.arrays()
+        recorded = (arr['pge'] >= 0).sum(axis=1)
+        found = ((arr['pge'] >= 0) & (arr['pge'] < order)).sum(axis=1)
+        return arr['trace'], found / np.maximum(recorded, 1)
+
+    def get_state(self):
+        """ Get the recorded rows as a dict of numpy arrays """
+        arr = self.arrays()
+        return dict(('rank_' + k, v) for (k, v) in arr.items())
+
+    def set_state(self, state):
+        """ Restore the rows returned by get_state(), with their top_k """
+        self.count = 0
+        self.top_k = np.shape(state['rank_hyp'])[2]
+        self._allocate(max(64, len(state['rank_trace'])))
+        n = len(state['rank_trace'])
+        self.trace[:n] = state['rank_trace']
+        self.pge[:n] = state['rank_pge']
+        self.hyp[:n] = state['rank_hyp']
+        if 'rank_point' in state:
+            self.point[:n] = state['rank_point']
+        self.value[:n] = state['rank_value']
+        self.count = n
+        self._rows = dict((int(t), row) for (row, t) in enumerate(self.trace[:n]))
+
+
 class Results(object):
     """
     Results type used for attacks generating peaks indicating the 'best' success. Examples include
     standard DPA & CPA attacks.
     """
 
-    def __init__(self, numSubkeys=16, numPerms=256):
+    def __init__(self, numSubkeys=16, numPerms=256, top_k=6):
         self.numSubkeys = numSubkeys
         self.numPerms = numPerms
         self.known_key = None
+        #Best guesses kept per trace count in rank_history (numPerms for maxes_list)
+        self.top_k = top_k
         self.clear()
 
     def key_guess(self):
@@ -80,7 +191,7 @@ class Results(object):
         return ret
 
     def clear(self):
-        #Diffs from CPA/DPA Attack
+        #Diffs from CPA/DPA Attack (see the diffs property)
         self.diffs = [None]*self.numSubkeys
 
         #Maximum diff & location of maximum
@@ -90,13 +201,77 @@ class Results(object):
 
         #If maximum diffs are valid & sorted correctly
         self.maxValid = [False]*self.numSubkeys
+        #Number of leading entries of maxes that are ranked (sorted)
+        self._ranked = [0]*self.numSubkeys
         self.pge = [255]*self.numSubkeys
         self.diffs_tnum = [None]*self.numSubkeys
-        self.pge_total = []
-        self.maxes_list = [list() for i in range(0, self.numSubkeys)]
+        self.rank_history = RankHistory(self.numSubkeys, self.numPerms, self.top_k)
+        #Sample points of interest the diffs of every subkey are over (None for all)
+        self.points = [None]*self.numSubkeys
 
         #TODO: Ensure this gets called by attack algorithms when rerunning
 
+    @property
+    def pge_total(self):
+        """ PGE of every subkey at every trace count, as a list of dicts with
+        'trace', 'subkey' and 'pge' (see rank_history for the arrays) """
+        arr = self.rank_history.arrays()
+        return [{'trace': None if t < 0 else int(t), 'subkey': i, 'pge': int(arr['pge'][row, i])}
+                for (row, t) in enumerate(arr['trace'])
+                for i in range(self.numSubkeys) if arr['pge'][row, i] >= 0]
+
+    @property
+    def top_k_maxes_list(self):
+        """ Best guesses of every subkey at every trace count, as a list per
+        subkey of dicts with 'trace' and 'maxes' (the rank_history.top_k first
+        entries of self.maxes) """
+        arr = self.rank_history.arrays()
+        out = [list() for i in range(0, self.numSubkeys)]
+        for (row, t) in enumerate(arr['trace']):
+            for i in range(self.numSubkeys):
+                if arr['pge'][row, i] < 0:
+                    continue
+                maxes = np.zeros(self.rank_history.top_k, dtype=self.maxes[i].dtype)
+                maxes['hyp'] = arr['hyp'][row, i]
+                maxes['point'] = arr['point'][row, i]
+                maxes['value'] = arr['value'][row, i]
+                out[i].append({'trace': None if t < 0 else int(t), 'maxes': maxes})
+        return out
+
+    @property
+    def maxes_list(self):
+        """ Maxima of every subkey at every trace count, as a list per subkey of
+        dicts with 'trace' and 'maxes' (all numPerms entries, like self.maxes)
+
+        Only available when every guess is ranked, set top_k to numPerms before
+        the attack (e.g. attack.get_statistics().top_k = 256) or use
+        top_k_maxes_list.
+        """
+        if self.rank_history.top_k < self.numPerms:
+            raise ValueError("maxes_list needs the full ranking, only the %d best guesses are kept "
+                             "(set top_k = %d before the attack or use top_k_maxes_list)"
+                             % (self.rank_history.top_k, self.numPerms))
+        return self.top_k_maxes_list
+
+    def get_state(self):
+        """ Get the PGE and maxima history as numpy arrays, e.g. for checkpoints
+
+        The diffs are not included, they are recomputed from the accumulated
+        statistics of the attack when resuming.
+
+        Returns:
+            dict of numpy arrays, see set_state().
+        """
+        state = {}
+        state['pge'] = np.array(self.pge, dtype=np.int64)
+        state.update(self.rank_history.get_state())
+        return state
+
+    def set_state(self, state):
+        """ Restore the PGE and maxima history returned by get_state() """
+        self.pge = [int(p) for p in state['pge']]
+        self.rank_history.set_state(state)
+
     def calc_PGE(self, bnum):
         if self.known_key is None:
             raise ValueError("Set result.known_key before running this method!")
@@ -125,22 +300,59 @@ class Results(object):
 
     setKnownkey = camel_case_deprecated(set_known_key)
 
+    def set_points(self, bnum, points):
+        """Sets the sample points the diffs of subkey bnum are over (column i of
+        the diffs being sample points[i]), so that the location of the maxima is
+        reported as a sample point. None if the diffs are over all the samples."""
+        self.points[bnum] = None if points is None else np.asarray(points, dtype=np.intp)
+        self.maxValid[bnum] = False
+
+    @property
+    def diffs(self):
+        """Correlation traces of every subkey (numPerms x samples, or None).
+        Reading them computes the ones still pending, see update_subkey()."""
+        for bnum in range(self.numSubkeys):
+            self._materialize(bnum)
+        return self._diffs
+
+    @diffs.setter
+    def diffs(self, diffs):
+        self._diffs = diffs
+        self._pending = [None]*len(diffs)
+
+    def _materialize(self, bnum):
+        """Compute the pending diffs of subkey bnum, if any."""
+        provider = self._pending[bnum]
+        if provider is not None:
+            self._pending[bnum] = None
+            self._diffs[bnum] = provider()
+
     def update_subkey(self, bnum, data, copy=True, force_update=False, tnum=None):
         """Update the specific subkey.
 
         Args:
             bnum (int): The index of the subkey.
-            data (int): The new subkey byte.
+            data: The new diffs of the subkey, or a function returning them:
+                they are then only computed when read (diffs, find_maximums()),
+                so that batches nobody looks at cost no correlation.
             copy (int):
+            tnum (int, optional): Number of traces the diffs are over.
         """
-        if (id(data) != id(self.diffs[bnum])) or force_update:
+        if callable(data):
+            self._pending[bnum] = data
+            self.diffs_tnum[bnum] = tnum
+            self.maxValid[bnum] = False
+            return
+
+        self._pending[bnum] = None
+        if (id(data) != id(self._diffs[bnum])) or force_update:
             self.maxValid[bnum] = False
 
             if data is not None and copy:
-                self.diffs[bnum] = data[:]
+                self._diffs[bnum] = data[:]
                 self.diffs_tnum[bnum] = tnum
             else:
-                self.diffs[bnum] = data
+                self._diffs[bnum] = data
                 self.diffs_tnum[bnum] = tnum
 
     updateSubkey = camel_case_deprecated(update_subkey)
@@ -158,7 +370,7 @@ class Results(object):
         res = self.find_maximums(use_absolute=use_absolute)
         return [subkey[0][0] for subkey in res]
 
-    def find_maximums(self, bytelist=None, use_absolute=True, use_single=False):
+    def find_maximums(self, bytelist=None, use_absolute=True, use_single=False, top_k=None):
         """Information from the attack:
 
         Args:
@@ -168,6 +380,9 @@ class Results(object):
                 correlation.
             use_single (bool): All table values are taken from the same point the
                 maximum is taken from.
+            top_k (int, optional): Only rank the top_k best guesses of every
+                subkey and return those, instead of sorting all of them. The
+                PGE is still computed, without sorting.
 
 
         Returns:
@@ -190,32 +405,44 @@ class Results(object):
             print(attack_results.find_maximums()[4][0][2])
 
         Note the "point location of the max" is normally not calculated/tracked,
-        and thus returns as a 0.
+        and thus returns as a 0. With points of interest (see set_points()) it
+        is the sample point, not the column of the diffs.
         """
         if bytelist is None:
             bytelist = list(range(0, self.numSubkeys))
 
+        #Number of leading guesses that must be ranked
+        need = self.numPerms if top_k is None else min(top_k, self.numPerms)
+        need = max(need, self.rank_history.top_k)
+
         # print useAbsolute
 
         for i in bytelist:
-            if self.diffs[i] is None:
+            self._materialize(i)
+            if self._diffs[i] is None:
                 self.maxValid[i] = False
                 continue
 
             if self.maxValid[i] == False:
-                for hyp in range(0, self.numPerms):
-                    if use_absolute:
-                        v = np.nanmax(np.fabs(self.diffs[i][hyp]))
-                    else:
-                        v = np.nanmax(self.diffs[i][hyp])
-
-                    mvalue = v
-
-                    #Get maximum value for this hypothesis
-                    mindex = np.nanargmax(np.fabs(self.diffs[i][hyp]))
-                    self.maxes[i][hyp]['hyp'] = hyp
-                    self.maxes[i][hyp]['point'] = mindex
-                    self.maxes[i][hyp]['value'] = mvalue
+                #All hypotheses at once: diffs is numPerms x samples
+                diffs = np.asarray(self._diffs[i], dtype=np.double)
+                if diffs.ndim == 1:
+                    #No samples accumulated yet (one value per hypothesis)
+                    diffs = diffs[:, None]
+                absdiffs = np.fabs(diffs)
+                nans = np.isnan(absdiffs)
+
+                #Get maximum value for every hypothesis (NaNs ignored, as nanargmax)
+                mindex = np.where(nans, -np.inf, absdiffs).argmax(axis=1)
+                if use_absolute:
+                    mvalue = absdiffs[np.arange(self.numPerms), mindex]
+                else:
+                    mvalue = np.where(nans, -np.inf, diffs).max(axis=1)
+                    mvalue[nans.all(axis=1)] = np.nan
+
+                self.maxes[i]['hyp'] = np.arange(self.numPerms)
+                self.maxes[i]['point'] = mindex
+                self.maxes[i]['value'] = mvalue
 
                 #TODO: why does this fail?
                 #self.maxes[i][np.isnan(self.maxes[i]['value'])]['value'] = 0
@@ -225,29 +452,62 @@ class Results(object):
                 if use_single:
                     #All table values are taken from same point MAX is taken from
                     where = self.maxes[i][0]['point']
-                    for j in range(0, self.numPerms):
-                        self.maxes[i][j]['point'] = where
-                        self.maxes[i][j]['value'] = self.diffs[i][self.maxes[i][j]['hyp']][where]
+                    self.maxes[i]['point'] = where
+                    self.maxes[i]['value'] = diffs[self.maxes[i]['hyp'], where]
 
-                self.maxes[i][::-1].sort(order='value') # sorts nunpy array in place and in reverse order
+                if self.points[i] is not None:
+                    self.maxes[i]['point'] = self.points[i][self.maxes[i]['point']]
+
+                #Guesses are ranked lazily, see _rank()
+                self._ranked[i] = 0
                 self.maxValid[i] = True
 
                 if self.known_key is not None:
-                    try:
-                        self.pge[i] = np.where(self.maxes[i]['hyp'] == self.known_key[i])[0][0] - numnans
-                        # print(self.pge)
-                        if self.pge[i] < 0:
-                            self.pge[i] = self.numPerms/2
-                    except IndexError as e:
-                        print("AHHH " + str(e))
-                        self.pge[i] = self.numPerms-1
+                    self.pge[i] = self._known_rank(i) - numnans
+                    # print(self.pge)
+                    if self.pge[i] < 0:
+                        self.pge[i] = self.numPerms/2
 
-            tnum = self.diffs_tnum[i]
-            self.pge_total.append({'trace':tnum, 'subkey':i, 'pge':self.pge[i]})
+            if self._ranked[i] < need:
+                self._rank(i, need)
 
-            if len(self.maxes_list[i]) == 0 or self.maxes_list[i][-1]['trace'] != tnum:
-                self.maxes_list[i].append({'trace':tnum, 'maxes':np.array(self.maxes[i])})
+            #The top_k first maxima are ranked (need >= rank_history.top_k)
+            self.rank_history.record(i, self.diffs_tnum[i], self.pge[i], self.maxes[i])
 
+        if top_k is not None:
+            return [m[:top_k] for m in self.maxes]
         return self.maxes
 
+    def _rank(self, bnum, k):
+        """Put the k best guesses of subkey bnum first in self.maxes[bnum], sorted."""
+        maxes = self.maxes[bnum]
+        if k >= self.numPerms:
+            maxes[::-1].sort(order='value') # sorts nunpy array in place and in reverse order
+            self._ranked[bnum] = self.numPerms
+            return
+
+        #Same order as the full sort: NaN first, then value and hyp descending
+        nans = np.isnan(maxes['value'])
+        value = np.where(nans, 0, maxes['value'])
+        key = np.where(nans, np.inf, value)
+        threshold = np.partition(key, self.numPerms - k)[self.numPerms - k]
+        cand = np.flatnonzero(key >= threshold)
+        cand = cand[np.lexsort((maxes['hyp'][cand], value[cand], nans[cand]))[::-1]][:k]
+        rest = np.setdiff1d(np.arange(self.numPerms), cand, assume_unique=True)
+        maxes[:] = maxes[np.concatenate((cand, rest))]
+        self._ranked[bnum] = k
+
+    def _known_rank(self, bnum):
+        """Position of the known key of subkey bnum in the full ranking, counted without sorting."""
+        maxes = self.maxes[bnum]
+        known = np.flatnonzero(maxes['hyp'] == self.known_key[bnum])
+        if len(known) == 0:
+            #Known key outside the hypotheses: worst rank, as before
+            return self.numPerms - 1 + np.isnan(maxes['value']).sum()
+        (v, h) = (maxes['value'][known[0]], maxes['hyp'][known[0]])
+        nans = np.isnan(maxes['value'])
+        if np.isnan(v):
+            return (nans & (maxes['hyp'] > h)).sum()
+        return nans.sum() + (maxes['value'] > v).sum() + ((maxes['value'] == v) & (maxes['hyp'] > h)).sum()
+
     findMaximums = camel_case_deprecated(find_maximums)
@@ -0,0 +1,123 @@
+import numpy as np
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+
+def split_trace_range(trace_range, shards, interval=1):
+    """Split trace_range into consecutive, non-overlapping shards.
+
+    Args:
+        trace_range (list): [start, end) of the whole attack.
+        shards (int): Number of shards wanted.
+        interval (int, optional): Shard boundaries are rounded to a multiple
+            of interval (e.g. the reporting interval) from the start.
+
+    Returns:
+        List of [start, end) trace ranges, empty shards left out.
+    """
+    (start, end) = trace_range
+    numtraces = end - start
+    step = -(-numtraces // shards)
+    step = -(-step // interval) * interval
+    return [[s, min(s + step, end)] for s in range(start, end, step)]
+
+
+class AccumulatorState(object):
+    """Sufficient statistics of a progressive CPA run over some trace ranges.
+
+    Runs over disjoint trace ranges of the same traces (other processes, other
+    machines, ...) give states that merge into exactly the statistics of a
+    single run over all of them, see CPAProgressiveCustom.merge_states().
+
+    Attributes:
+        algorithm (str): Module of the algorithm that produced the state, states
+            of different algorithms cannot be merged.
+        trace_ranges (list): [start, end) trace ranges accumulated.
+        point_range (list): Sample range used, or None for whole traces.
+        subkeys (dict): Maps each subkey byte to the dict returned by
+            CPAProgressiveOneSubkey.get_state().
+    """
+    def __init__(self, algorithm, trace_ranges, point_range, subkeys):
+        self.algorithm = algorithm
+        self.trace_ranges = [list(r) for r in trace_ranges]
+        self.point_range = None if point_range is None else list(point_range)
+        self.subkeys = subkeys
+
+    @property
+    def num_traces(self):
+        return sum(end - start for (start, end) in self.trace_ranges)
+
+    def to_arrays(self):
+        """Flatten the state into a dict of numpy arrays, see from_arrays()."""
+        arrays = {
+            'algorithm': np.array(self.algorithm),
+            'trace_ranges': np.array(self.trace_ranges, dtype=np.int64).reshape(-1, 2),
+            'point_range': np.array(self.point_range if self.point_range is not None else [], dtype=np.int64),
+        }
+        for (bnum, state) in self.subkeys.items():
+            for (name, value) in state.items():
+                arrays['subkey%d/%s' % (bnum, name)] = np.asarray(value)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, data):
+        """Rebuild a state from to_arrays() output (or an opened .npz file holding it)."""
+        subkeys = {}
+        for name in data.keys():
+            if not name.startswith('subkey'):
+                continue
+            (bnum, field) = name[len('subkey'):].split('/', 1)
+            value = data[name]
+            subkeys.setdefault(int(bnum), {})[field] = value.item() if value.ndim == 0 else value
+        point_range = data['point_range'].tolist() or None
+        return cls(str(data['algorithm']), data['trace_ranges'].tolist(), point_range, subkeys)
+
+    def save(self, path):
+        """Write the state into an uncompressed .npz file (no pickling)."""
+        with open(path, 'wb') as f:
+            np.savez(f, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """Read a state written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls.from_arrays(data)
+
+    def __repr__(self):
+        return "AccumulatorState({}, traces={}, subkeys={})".format(
+            self.algorithm.rsplit('.', 1)[-1], self.trace_ranges, sorted(self.subkeys))
+
+
+def check_mergeable(states, algorithm):
+    """Check that states can be merged into one run of algorithm.
+
+    Args:
+        states (list): AccumulatorState instances, or paths to load them from.
+        algorithm (str): Module of the algorithm doing the merge.
+
+    Returns:
+        Tuple (states, trace_ranges, point_range) with states loaded and
+        trace_ranges the sorted union of all their ranges.
+
+    Raises:
+        ValueError: If the states come from another algorithm, used different
+            sample ranges or have overlapping trace ranges (those traces would
+            be counted twice).
+    """
+    states = [s if isinstance(s, AccumulatorState) else AccumulatorState.load(s) for s in states]
+    if len(states) == 0:
+        raise ValueError("No states to merge")
+
+    point_range = states[0].point_range
+    for s in states:
+        if s.algorithm != algorithm:
+            raise ValueError("Cannot merge a state of %s into %s" % (s.algorithm, algorithm))
+        if s.point_range != point_range:
+            raise ValueError("Cannot merge states over different point ranges (%s and %s)" % (point_range, s.point_range))
+
+    trace_ranges = sorted(r for s in states for r in s.trace_ranges if r[1] > r[0])
+    for (a, b) in zip(trace_ranges, trace_ranges[1:]):
+        if b[0] < a[1]:
+            raise ValueError("Trace ranges %s and %s overlap" % (a, b))
+    return states, trace_ranges, point_range
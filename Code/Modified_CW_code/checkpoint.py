@@ -0,0 +1,68 @@
+import os
+import numpy as np
+from chipwhisperer.analyzer.attacks.cpa_algorithms.accumulator_state import AccumulatorState
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+
+class Checkpoint(object):
+    """Everything needed to continue an interrupted progressive CPA run.
+
+    Written every few batches by the progressive algorithms when a checkpoint
+    file is set (see CPA.run()). The traces already accumulated by each subkey
+    byte are given by its state, so a resumed run only reads the rest of
+    trace_range.
+
+    Attributes:
+        state (AccumulatorState): Accumulated statistics of every subkey byte.
+        trace_range (list): [start, end) trace range of the whole run.
+        results (dict): Results.get_state() of the attack statistics.
+    """
+    def __init__(self, state, trace_range, results):
+        self.state = state
+        self.trace_range = list(trace_range)
+        self.results = results
+
+    @property
+    def position(self):
+        """Number of traces of trace_range done by every subkey byte."""
+        return self.state.num_traces
+
+    def check(self, algorithm, trace_range, point_range):
+        """Raise ValueError if the checkpoint is not of a run of algorithm over
+        trace_range and point_range."""
+        if self.state.algorithm != algorithm:
+            raise ValueError("Checkpoint of %s cannot be resumed by %s" % (self.state.algorithm, algorithm))
+        if self.trace_range != list(trace_range):
+            raise ValueError("Checkpoint is for traces %s, not %s" % (self.trace_range, list(trace_range)))
+        if self.state.point_range != (None if point_range is None else list(point_range)):
+            raise ValueError("Checkpoint is for points %s, not %s" % (self.state.point_range, point_range))
+
+    def save(self, path):
+        """Write the checkpoint into an uncompressed .npz file.
+
+        The file is written next to path first and then renamed over it, so a
+        crash while saving leaves the previous checkpoint intact.
+        """
+        arrays = self.state.to_arrays()
+        arrays['checkpoint/trace_range'] = np.array(self.trace_range, dtype=np.int64)
+        for (name, value) in self.results.items():
+            arrays['results/' + name] = value
+
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a checkpoint written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            state = AccumulatorState.from_arrays(data)
+            results = dict((name[len('results/'):], data[name]) for name in data.files
+                           if name.startswith('results/'))
+            return cls(state, data['checkpoint/trace_range'].tolist(), results)
+
+    def __repr__(self):
+        return "Checkpoint(trace_range={}, position={})".format(self.trace_range, self.position)
@@ -0,0 +1,81 @@
+import numpy as np
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+
+class ConvergenceMonitor(object):
+    """Early stopping of the progressive algorithms: tells when a subkey byte has converged.
+
+    A byte has converged once the same guess has been its best guess for
+    `patience` consecutive batches, each time ahead of the second best guess
+    by at least `margin` of correlation and, if the known key is used, with
+    the known key as best guess (PGE == 0). The algorithms then stop feeding
+    traces to that byte, and stop the run when all the bytes have converged.
+    The known key is the one of the Results if set, else the one of the
+    traces; the monitor keeps its own copy and does not change the Results.
+
+    Args:
+        patience (int): Number of consecutive batches the best guess must hold.
+        margin (float, optional): Minimum correlation difference between the
+            best and the second best guess.
+        use_known_key (bool, optional): Also require PGE == 0 when a known
+            key is available.
+    """
+    def __init__(self, patience, margin=0.0, use_known_key=False):
+        self.patience = patience
+        self.margin = margin
+        self.use_known_key = use_known_key
+        self.known_key = None
+        self._best = {}
+        self._streak = {}
+        self._start = {}
+        self.traces_to_disclosure = {}
+
+    def set_known_key(self, stats, model, knownkeys):
+        """Take the known key of stats, or else of the traces, if the known key is used."""
+        if not self.use_known_key:
+            return
+        if stats.known_key is not None:
+            self.known_key = stats.known_key
+        elif self.known_key is None and len(knownkeys) > 0:
+            self.known_key = model.process_known_key(knownkeys[-1])
+
+    def update(self, stats, bnum, tnum):
+        """Check subkey bnum after a batch.
+
+        Args:
+            stats (Results): Statistics the correlation of bnum was given to.
+            bnum (int): Subkey byte number.
+            tnum (int): Number of traces bnum has processed.
+
+        Returns:
+            True if bnum has converged.
+        """
+        maxes = stats.find_maximums(bytelist=[bnum], top_k=2)[bnum]
+        best = int(maxes[0]['hyp'])
+        gap = maxes[0]['value'] - maxes[1]['value'] if len(maxes) > 1 else np.inf
+        ok = bool(gap >= self.margin)
+        if self.use_known_key and self.known_key is not None:
+            ok = ok and best == self.known_key[bnum]
+
+        if not ok:
+            self._streak[bnum] = 0
+        elif self._streak.get(bnum, 0) > 0 and self._best.get(bnum) == best:
+            self._streak[bnum] += 1
+        else:
+            self._streak[bnum] = 1
+            self._start[bnum] = tnum
+        self._best[bnum] = best
+
+        if self._streak[bnum] >= self.patience and bnum not in self.traces_to_disclosure:
+            self.traces_to_disclosure[bnum] = self._start[bnum]
+        return self.converged(bnum)
+
+    def converged(self, bnum):
+        """Whether subkey bnum has converged."""
+        return bnum in self.traces_to_disclosure
+
+    def all_converged(self, bnums):
+        """Whether all the subkeys in bnums have converged."""
+        return all(self.converged(bnum) for bnum in bnums)
@@ -3,6 +3,7 @@ from chipwhisperer.common.api.ProjectFormat import Project
 from collections import OrderedDict
 from chipwhisperer.common.utils.util import dict_to_str
 from chipwhisperer.analyzer.attacks.cpa_algorithms.progressive_custom import CPAProgressiveCustom
+from chipwhisperer.analyzer.attacks.cpa_algorithms.checkpoint import Checkpoint
 import IPython as ip
 
 #THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/
@@ -148,7 +149,8 @@ class CPA(CPA_Old):
     def results(self):
         return self.get_statistics()
 
-    def run(self, callback=None, update_interval=25):
+    def run(self, callback=None, update_interval=25, checkpoint=None, checkpoint_every=10, resume_from=None,
+            early_stop=None, stop_margin=0.0, stop_on_known_key=False):
         """ Runs the attack
 
         Args:
@@ -156,6 +158,22 @@ class CPA(CPA_Old):
                 interval. No arguments are passed to callback. Defaults to None.
             update_interval (int, optional):  Number of traces to process
                 before updating the results of the attack.
+            checkpoint (str, optional): File to save a Checkpoint into every
+                checkpoint_every updates and at the end of the run.
+            checkpoint_every (int, optional): Number of updates between
+                checkpoints.
+            resume_from (str or Checkpoint, optional): Checkpoint of an
+                interrupted run with the same trace_range and point_range to
+                continue from, instead of starting over. Stored sumden pairs /
+                variances from before the checkpoint are not restored.
+            early_stop (int, optional): Stop attacking a subkey once its best
+                guess has held for early_stop consecutive updates, and stop the
+                run once all subkeys have. See traces_to_disclosure().
+            stop_margin (float, optional): Minimum correlation difference
+                between the best and second best guess for early_stop.
+            stop_on_known_key (bool, optional): For early_stop, also require
+                the best guess to be the known key (PGE == 0) when the
+                results or the traces have one.
 
         Returns:
             Results, the results of the attack. See documentation
@@ -168,10 +186,97 @@ class CPA(CPA_Old):
         self.algorithm.set_reporting_interval(self.reporting_interval)
         self.algorithm.set_target_subkeys(self.get_target_subkeys())
         self.algorithm.setStatsReadyCallback(callback)
+        if hasattr(self.algorithm, 'set_checkpoint'):
+            self.algorithm.set_checkpoint(checkpoint, checkpoint_every)
+            if resume_from is not None and not isinstance(resume_from, Checkpoint):
+                resume_from = Checkpoint.load(resume_from)
+            self.algorithm.set_resume(resume_from)
+        if hasattr(self.algorithm, 'set_early_stop'):
+            self.algorithm.set_early_stop(early_stop, stop_margin, stop_on_known_key)
         self.algorithm.addTraces(self.get_trace_source(), self.trace_range,
                                  None, pointRange=self.point_range)
         return self.results
     
+    def traces_to_disclosure(self):
+        """ Traces needed by each subkey in the last run with early_stop
+
+        Returns:
+            dict mapping each subkey that converged to the number of traces
+            from which its best guess held.
+        """
+        if hasattr(self.algorithm, 'get_traces_to_disclosure'):
+            return self.algorithm.get_traces_to_disclosure()
+        return {}
+
+    def select_points(self, method='cpa', count=50, num_traces=500, window=0):
+        """ Restrict the next runs to the points of interest of every subkey
+
+        The points are chosen from a first pass over the first num_traces
+        traces of trace_range, see poi.select_points(). The maxima locations
+        of the results are still sample points (relative to point_range).
+
+        Args:
+            method (str, optional): 'cpa', 'snr' (needs the known key) or
+                'variance'.
+            count (int, optional): Number of points per subkey.
+            num_traces (int, optional): Number of traces of the first pass.
+            window (int, optional): Also keep the window samples around
+                every point.
+
+        Returns:
+            dict mapping each subkey to its sorted points.
+        """
+        from chipwhisperer.analyzer.attacks.cpa_algorithms.poi import select_points
+        points = select_points(self.get_trace_source(), self.leak_model, list(self.get_target_subkeys()),
+                               self.trace_range, self.point_range, method, count, num_traces, window)
+        self.set_points(points)
+        return points
+
+    def set_points(self, points):
+        """ Only attack some sample points (relative to point_range)
+
+        Args:
+            points: One list for all subkeys, a dict mapping each subkey to
+                its list (see select_points()), or None for all the samples.
+        """
+        if hasattr(self.algorithm, 'set_points'):
+            self.algorithm.set_points(points)
+
+    def get_state(self):
+        """ Accumulated statistics of the last run, for merging with other runs
+
+        Example of an attack split into shards (each run may as well be done
+        by another process or machine, saving the state with state.save(path))::
+
+            from chipwhisperer.analyzer.attacks.cpa_algorithms.accumulator_state import split_trace_range
+            states = []
+            for rng in split_trace_range(attack.trace_range, 4):
+                attack.trace_range = rng
+                attack.run()
+                states.append(attack.get_state())
+            results = attack.merge(states)
+
+        Returns:
+            AccumulatorState of the algorithm.
+        """
+        return self.algorithm.get_state()
+
+    def merge(self, states):
+        """ Merge the states of runs over disjoint trace ranges
+
+        Args:
+            states (list): AccumulatorState instances (see get_state()) or
+                paths of states saved with AccumulatorState.save().
+
+        Returns:
+            Results, the same as for one run over the traces of all states.
+        """
+        self.algorithm.setModel(self.leak_model)
+        self.algorithm.get_statistics().clear()
+        self.algorithm.set_target_subkeys(self.get_target_subkeys())
+        self.algorithm.merge_states(states)
+        return self.results
+
     def get_variance_terms(self):
         """Method to retrieve variance terms from the analysis algorithm."""
         if hasattr(self._analysisAlgorithm, 'get_variance_terms'):
@@ -0,0 +1,204 @@
+import numpy as np
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+
+class HistoryRecorder(object):
+    """Selects which intermediate statistics the progressive algorithms keep.
+
+    For every recorded batch each subkey byte stores the trace side variance
+    term (sumden2 / Welford trace variance) once, and the hypothesis side term
+    (sumden1 / hypothesis variance) of the selected key guesses, optionally
+    with their correlation. Storage is preallocated per byte within max_bytes;
+    when it is full every other recorded batch is dropped and only every
+    second batch is recorded from then on, so long runs end up with an evenly
+    decimated history instead of running out of memory.
+
+    Subclasses may override wants() and subkey() to record differently.
+
+    Example::
+
+        from chipwhisperer.analyzer.attacks.cpa_algorithms.history import HistoryRecorder
+        attack.algorithm.set_history(HistoryRecorder(keys=3, window=None, log_base=2))
+
+    Args:
+        keys: Key guesses to record: 'all', 'known' (the correct guess, from
+            the known key of the traces), an int k for the k best guesses at
+            each batch, or a list of guesses.
+        points (list, optional): Sample points (indices into the cropped
+            traces) to keep. None keeps every point.
+        window (tuple, optional): Only batches within the (start, end) traces
+            are recorded. None records the whole run.
+        stride (int, optional): Record one batch out of stride.
+        log_base (float, optional): Only record batches containing a trace
+            count that is a power of log_base (e.g. 2: traces 1, 2, 4, 8, ...).
+        diffs (bool, optional): Also record the correlation traces of the
+            selected guesses.
+        max_bytes (int, optional): Memory budget shared by all subkey bytes.
+    """
+    def __init__(self, keys='all', points=None, window=(0, 5000), stride=1, log_base=None, diffs=False,
+                 max_bytes=256 * 2**20):
+        self.keys = keys
+        self.points = None if points is None else np.asarray(points, dtype=np.intp)
+        self.window = window
+        self.stride = stride
+        self.log_base = log_base
+        self.diffs = diffs
+        self.max_bytes = max_bytes
+
+    def wants(self, tstart, tend, interval):
+        """Whether the batch of traces [tstart, tend) is recorded (same for every subkey byte)."""
+        if self.window is not None and not (tstart >= self.window[0] and tend <= self.window[1]):
+            return False
+        if (tstart // interval) % self.stride:
+            return False
+        if self.log_base is not None:
+            v = 1
+            while v <= tstart:
+                v *= self.log_base
+            return v <= tend
+        return True
+
+    def subkey(self, numbytes=1):
+        """New (empty) storage for one of numbytes subkey bytes."""
+        return SubkeyHistory(self, self.max_bytes // max(1, numbytes))
+
+
+class SubkeyHistory(object):
+    """Preallocated, bounded history of one subkey byte (see HistoryRecorder)."""
+    def __init__(self, recorder, max_bytes):
+        self.recorder = recorder
+        self.max_bytes = max_bytes
+        self.bnum = None
+        self.count = 0
+        self.every = 1
+        self._seen = 0
+        self.tnum = None
+        self.keys = None
+        self.hyp = None
+        self.trace = None
+        self.diffs = None
+
+    def _select(self, hyp_terms, diffs, known_key):
+        keys = self.recorder.keys
+        if isinstance(keys, str) and keys == 'all':
+            return np.arange(len(hyp_terms))
+        if isinstance(keys, str) and keys == 'known':
+            if known_key is None:
+                raise ValueError("History of keys='known' needs the known key of the traces")
+            return np.array([known_key])
+        if isinstance(keys, (int, np.integer)):
+            peaks = np.nanmax(np.fabs(np.asarray(diffs, dtype=np.double)), axis=1)
+            return np.argsort(-peaks, kind='stable')[:keys]
+        return np.asarray(keys)
+
+    def _capacity(self, rowbytes):
+        return max(2, self.max_bytes // rowbytes)
+
+    def _allocate(self, numkeys, numpoints):
+        rowbytes = 8 + numkeys * (2 + 8) + numpoints * 8
+        if self.recorder.diffs:
+            rowbytes += numkeys * numpoints * 8
+        capacity = self._capacity(rowbytes)
+        self.tnum = np.zeros(capacity, dtype=np.int64)
+        self.keys = np.zeros((capacity, numkeys), dtype=np.int16)
+        self.hyp = np.zeros((capacity, numkeys), dtype=np.double)
+        self.trace = np.zeros((capacity, numpoints), dtype=np.double)
+        if self.recorder.diffs:
+            self.diffs = np.zeros((capacity, numkeys, numpoints), dtype=np.double)
+
+    def _overflow(self):
+        # called when the preallocated rows are full
+        self._compact()
+
+    def _compact(self):
+        # keep every other recorded batch and record half as often from now on
+        kept = (self.count + 1) // 2
+        for arr in (self.tnum, self.keys, self.hyp, self.trace, self.diffs):
+            if arr is not None:
+                arr[:kept] = arr[0:self.count:2]
+        self.count = kept
+        self.every *= 2
+
+    def record(self, bnum, tnum, hyp_terms, trace_term, diffs=None, known_key=None):
+        """Record one batch.
+
+        Args:
+            bnum (int): Subkey byte number.
+            tnum (int): Number of traces accumulated so far.
+            hyp_terms: Hypothesis side term of every key guess.
+            trace_term: Trace side term, one value per sample point.
+            diffs: Correlation of every key guess (numPerms x samples), needed
+                for keys=k and diffs=True. May be a function returning it, only
+                called then.
+            known_key (int, optional): Correct key guess, needed for keys='known'.
+        """
+        seen = self._seen
+        self._seen += 1
+        if seen % self.every:
+            return
+        if callable(diffs):
+            needed = self.recorder.diffs or isinstance(self.recorder.keys, (int, np.integer))
+            diffs = diffs() if needed else None
+
+        self.bnum = bnum
+        keys = self._select(hyp_terms, diffs, known_key)
+        points = self.recorder.points
+        trace_term = np.asarray(trace_term)
+        if points is not None:
+            trace_term = trace_term[points]
+        if self.tnum is None:
+            self._allocate(len(keys), len(trace_term))
+
+        if self.count == len(self.tnum):
+            self._overflow()
+            if seen % self.every:
+                return
+
+        row = self.count
+        self.tnum[row] = tnum
+        self.keys[row] = keys
+        self.hyp[row] = np.asarray(hyp_terms)[keys]
+        self.trace[row] = trace_term
+        if self.diffs is not None:
+            d = np.asarray(diffs, dtype=np.double)[keys]
+            self.diffs[row] = d if points is None else d[:, points]
+        self.count += 1
+
+    def flush(self):
+        """Called at the end of a run, nothing to do for in-memory histories."""
+        pass
+
+    def arrays(self):
+        """Views of the recorded rows: dict with tnum (batches), keys and hyp
+        (batches x keys), trace (batches x points) and diffs (batches x keys x
+        points, or None)."""
+        n = self.count
+        return {
+            'tnum': self.tnum[:n] if self.tnum is not None else np.zeros(0, dtype=np.int64),
+            'keys': self.keys[:n] if self.keys is not None else np.zeros((0, 0), dtype=np.int16),
+            'hyp': self.hyp[:n] if self.hyp is not None else np.zeros((0, 0)),
+            'trace': self.trace[:n] if self.trace is not None else np.zeros((0, 0)),
+            'diffs': self.diffs[:n] if self.diffs is not None else None,
+        }
+
+    def tuples(self):
+        """The history as (hyp_term, bnum, key, trace_term) tuples, ordered by batch then key."""
+        arr = self.arrays()
+        out = []
+        for row in range(len(arr['tnum'])):
+            for (key, hyp) in zip(arr['keys'][row], arr['hyp'][row]):
+                out.append((hyp, self.bnum, int(key), arr['trace'][row]))
+        return out
+
+    def diffs_tuples(self):
+        """The recorded correlations as (diffs, bnum, key) tuples, ordered by batch then key."""
+        arr = self.arrays()
+        out = []
+        if arr['diffs'] is None:
+            return out
+        for row in range(len(arr['tnum'])):
+            for (i, key) in enumerate(arr['keys'][row]):
+                out.append((arr['diffs'][row, i], self.bnum, int(key)))
+        return out
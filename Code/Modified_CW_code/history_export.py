@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import shutil
+import numpy as np
+from chipwhisperer.analyzer.attacks.cpa_algorithms.history import HistoryRecorder, SubkeyHistory
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+_FIELDS = ('tnum', 'keys', 'hyp', 'trace', 'diffs')
+
+
+class ExportRecorder(HistoryRecorder):
+    """HistoryRecorder writing the recorded statistics to disk during the run.
+
+    Every subkey byte gets its own directory inside path, where each chunk of
+    chunk_batches recorded batches is written as one .npy file per field
+    (tnum, keys, hyp, trace and, with diffs=True, diffs), or as one
+    compressed .npz file with compress=True. Only the chunk being filled is
+    kept in memory. Read the result with HistoryReader, which memory-maps
+    the .npy chunks so slicing e.g. one sample point of one byte only reads
+    those values.
+
+    Example::
+
+        from chipwhisperer.analyzer.attacks.cpa_algorithms.history_export import ExportRecorder, HistoryReader
+        attack.algorithm.set_history(ExportRecorder('sumdens', window=None))
+        attack.run(None, 100)
+        reader = HistoryReader('sumdens')
+        sumden2 = reader.trace(12, points=max_idx)     # all batches of byte 12
+
+    Args:
+        path (str): Directory to write into. Created if needed; the data of a
+            previous recorder in it is removed.
+        chunk_batches (int, optional): Number of recorded batches per chunk.
+        compress (bool, optional): Write compressed .npz chunks (smaller, but
+            read whole chunks at a time).
+        **kwargs: keys, points, window, stride, log_base and diffs of
+            HistoryRecorder.
+    """
+    def __init__(self, path, chunk_batches=64, compress=False, **kwargs):
+        HistoryRecorder.__init__(self, **kwargs)
+        self.path = path
+        self.chunk_batches = chunk_batches
+        self.compress = compress
+
+        # drop the byte directories of a previous run, a shorter run would
+        # otherwise leave its later chunks behind
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if re.match(r'b\d+$', name) and os.path.isdir(os.path.join(path, name)):
+                shutil.rmtree(os.path.join(path, name))
+
+        # numpy scalars (e.g. np.argmax()) are converted for json
+        if isinstance(self.keys, str):
+            keys = self.keys
+        elif np.ndim(self.keys) == 0:
+            keys = int(self.keys)
+        else:
+            keys = np.asarray(self.keys).astype(int).tolist()
+        meta = {
+            'keys': keys,
+            'points': None if self.points is None else self.points.tolist(),
+            'window': None if self.window is None else np.asarray(self.window).tolist(),
+            'stride': int(self.stride),
+            'log_base': None if self.log_base is None else float(self.log_base),
+            'diffs': bool(self.diffs),
+            'compress': compress,
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def subkey(self, numbytes=1):
+        return SubkeyHistoryWriter(self)
+
+
+class SubkeyHistoryWriter(SubkeyHistory):
+    """SubkeyHistory writing every full chunk of rows to disk (see ExportRecorder)."""
+    def __init__(self, recorder):
+        SubkeyHistory.__init__(self, recorder, None)
+        self.written = 0
+
+    def _capacity(self, rowbytes):
+        return self.recorder.chunk_batches
+
+    def _overflow(self):
+        self._write_chunk()
+
+    def _directory(self):
+        return os.path.join(self.recorder.path, 'b%02d' % self.bnum)
+
+    def _write_chunk(self):
+        if self.count == 0:
+            return
+        directory = self._directory()
+        if self.written == 0:
+            # first chunk of this run, drop the data of a previous one
+            os.makedirs(directory, exist_ok=True)
+            for name in os.listdir(directory):
+                if name.endswith('.npy') or name.endswith('.npz'):
+                    os.remove(os.path.join(directory, name))
+
+        rows = SubkeyHistory.arrays(self)
+        chunk = dict((field, rows[field]) for field in _FIELDS if rows[field] is not None)
+        if self.recorder.compress:
+            with open(os.path.join(directory, 'chunk_%08d.npz' % self.written), 'wb') as f:
+                np.savez_compressed(f, **chunk)
+        else:
+            for (field, arr) in chunk.items():
+                np.save(os.path.join(directory, '%s_%08d.npy' % (field, self.written)), arr)
+        self.written += self.count
+        self.count = 0
+
+    def flush(self):
+        """Write the rows of the last (partial) chunk."""
+        if self.bnum is not None:
+            self._write_chunk()
+
+    def arrays(self):
+        """All the rows of this byte: the ones written so far and the ones in memory."""
+        self.flush()
+        if self.bnum is None or self.written == 0:
+            return SubkeyHistory.arrays(self)
+        reader = HistoryReader(self.recorder.path)
+        return dict((field, reader.field(self.bnum, field)) for field in _FIELDS)
+
+
+class HistoryReader(object):
+    """Reads the statistics written by ExportRecorder.
+
+    Rows are the recorded batches, in order. Every method reads only the
+    chunks, rows and sample points it is asked for.
+
+    Args:
+        path (str): Directory given to ExportRecorder.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.bnums = sorted(int(name[1:]) for name in os.listdir(path)
+                            if name.startswith('b') and os.path.isdir(os.path.join(path, name)))
+        self._chunks = {}
+
+    def chunks(self, bnum):
+        """Sorted list of (first row, file) of the chunks of byte bnum."""
+        if bnum not in self._chunks:
+            directory = os.path.join(self.path, 'b%02d' % bnum)
+            starts = {}
+            for name in os.listdir(directory):
+                (stem, ext) = os.path.splitext(name)
+                if ext in ('.npy', '.npz'):
+                    start = int(stem.rsplit('_', 1)[1])
+                    starts[start] = name if ext == '.npz' else 'tnum_%08d.npy' % start
+            self._chunks[bnum] = sorted((start, os.path.join(directory, name)) for (start, name) in starts.items())
+        return self._chunks[bnum]
+
+    def _load(self, filename, start, field):
+        if filename.endswith('.npz'):
+            with np.load(filename) as data:
+                return data[field] if field in data.files else None
+        filename = os.path.join(os.path.dirname(filename), '%s_%08d.npy' % (field, start))
+        if not os.path.exists(filename):
+            return None
+        return np.load(filename, mmap_mode='r')
+
+    def field(self, bnum, field, batches=None, index=None):
+        """Rows of one field of byte bnum.
+
+        Args:
+            bnum (int): Subkey byte number.
+            field (str): 'tnum', 'keys', 'hyp', 'trace' or 'diffs'.
+            batches (optional): Rows to read (slice, list or boolean mask),
+                all of them by default.
+            index (tuple, optional): Index applied to every row, e.g. (slice(None), 5)
+                for point 5 of every key of diffs.
+
+        Returns:
+            numpy.ndarray, or None if the field was not recorded.
+        """
+        chunks = self.chunks(bnum)
+        total = self.num_batches(bnum)
+        rows = np.arange(total)
+        if batches is not None:
+            rows = rows[batches]
+
+        if len(chunks) == 0:
+            return None
+
+        parts = []
+        for (i, (start, filename)) in enumerate(chunks):
+            end = chunks[i + 1][0] if i + 1 < len(chunks) else total
+            wanted = rows[(rows >= start) & (rows < end)] - start
+            # the first chunk is always read, giving the shape of an empty selection
+            if len(wanted) == 0 and i > 0:
+                continue
+            arr = self._load(filename, start, field)
+            if arr is None:
+                return None
+            part = arr[wanted]
+            if index is not None:
+                part = part[(slice(None),) + tuple(index)]
+            parts.append(np.array(part))
+        return np.concatenate(parts)
+
+    def num_batches(self, bnum):
+        """Number of recorded batches of byte bnum."""
+        chunks = self.chunks(bnum)
+        if len(chunks) == 0:
+            return 0
+        (start, filename) = chunks[-1]
+        return start + len(self._load(filename, start, 'tnum'))
+
+    def _columns(self, points):
+        # maps sample points to the columns they were stored in
+        stored = self.meta['points']
+        if points is None or stored is None:
+            return points
+        lookup = dict((p, i) for (i, p) in enumerate(stored))
+        if np.ndim(points) == 0:
+            return lookup[int(points)]
+        return [lookup[int(p)] for p in points]
+
+    def tnum(self, bnum, batches=None):
+        """Number of traces accumulated at every recorded batch."""
+        return self.field(bnum, 'tnum', batches)
+
+    def keys(self, bnum, batches=None):
+        """Key guesses recorded at every batch (batches x keys)."""
+        return self.field(bnum, 'keys', batches)
+
+    def _key_column(self, bnum, key, batches):
+        keys = self.keys(bnum, batches)
+        found = (keys == key)
+        return found.any(axis=1), found.argmax(axis=1)
+
+    def hyp(self, bnum, key=None, batches=None):
+        """sumden1 / hypothesis variance: batches x keys, or of one key guess
+        (NaN at batches where key was not recorded, e.g. with keys=k)."""
+        hyp = self.field(bnum, 'hyp', batches)
+        if key is None:
+            return hyp
+        (present, column) = self._key_column(bnum, key, batches)
+        out = hyp[np.arange(len(hyp)), column]
+        out[~present] = np.nan
+        return out
+
+    def trace(self, bnum, points=None, batches=None):
+        """sumden2 / trace variance: batches x points, or batches for a single point."""
+        columns = self._columns(points)
+        if columns is None:
+            return self.field(bnum, 'trace', batches)
+        return self.field(bnum, 'trace', batches, (columns,))
+
+    def diffs(self, bnum, key, points=None, batches=None):
+        """Correlation of key guess key (batches x points, or batches for a single
+        point; NaN where key was not recorded). Needs ExportRecorder(diffs=True)."""
+        columns = self._columns(points)
+        index = (slice(None),) if columns is None else (slice(None), columns)
+        diffs = self.field(bnum, 'diffs', batches, index)
+        if diffs is None:
+            raise ValueError("No diffs recorded, use ExportRecorder(diffs=True)")
+        (present, column) = self._key_column(bnum, key, batches)
+        out = diffs[np.arange(len(diffs)), column]
+        out[~present] = np.nan
+        return out
+
+    def tuples(self, bnums=None):
+        """The history of bnums (all bytes by default) as (hyp_term, bnum, key,
+        trace_term) tuples, like get_sumden_pairs() / get_welford_variances()."""
+        out = []
+        for bnum in (self.bnums if bnums is None else bnums):
+            (keys, hyp, trace) = (self.keys(bnum), self.hyp(bnum), self.trace(bnum))
+            if keys is None:
+                continue
+            for row in range(len(keys)):
+                for (key, h) in zip(keys[row], hyp[row]):
+                    out.append((h, bnum, int(key), trace[row]))
+        return out
@@ -0,0 +1,250 @@
+import numpy as np
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import SBox_output, PtKey_XOR, InvSBox_output, \
+    InvSBox_output_alt, SBoxInOutDiff, LastroundHW, LastroundStateDiffAlternate, PipelineDiff, HalfPipelineDiff
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+# Leakage helpers whose output only depends on a single byte of textin/textout
+# (plus the key guess), so they can be tabulated as 256 x 256 lookup tables
+_TABULATED_MODELS = {
+    SBox_output: 'textin',
+    PtKey_XOR: 'textin',
+    InvSBox_output: 'textin',
+    InvSBox_output_alt: 'textin',
+    SBoxInOutDiff: 'textin',
+    LastroundHW: 'textout',
+    LastroundStateDiffAlternate: 'textout',
+}
+
+# Hamming distance models between successive encryptions (_has_prev) whose
+# intermediate value is a term of byte bnum of the text XOR a term of one byte of
+# the previous text ('same': byte bnum, 'invshift': byte INVSHIFT_undo[bnum]), so
+# they can be tabulated as two 256 x 256 tables, see build_distance_tables()
+_DISTANCE_MODELS = {
+    PipelineDiff: ('textout', 'same'),
+    HalfPipelineDiff: ('textout', 'invshift'),
+}
+
+
+def table_source(model):
+    """Return which text ('textin' or 'textout') indexes the leakage table of
+    model, or None if model cannot be tabulated."""
+    if getattr(model, '_has_prev', False):
+        return None
+    return _TABULATED_MODELS.get(type(getattr(model, 'modelobj', None)))
+
+
+def build_leakage_table(model, bnum, source):
+    """Build the (text byte x key guess) leakage table for subkey bnum.
+
+    Args:
+        model (AESLeakageHelper): Leakage model, must be tabulable.
+        bnum (int): Subkey byte number.
+        source (str): 'textin' or 'textout', as given by table_source().
+
+    Returns:
+        numpy.ndarray of shape (256, numPerms), table[v, key] being the
+        leakage of key guess key when byte bnum of the text is v.
+    """
+    numPerms = model.getPermPerSubkey()
+    table = np.zeros((256, numPerms), dtype=np.double)
+    state = {'knownkey': None}
+    text = [0] * model.getNumSubKeys()
+    for v in range(256):
+        text[bnum] = v
+        for key in range(numPerms):
+            if source == 'textin':
+                table[v, key] = model.leakage(text, None, key, bnum, state)
+            else:
+                table[v, key] = model.leakage(None, text, key, bnum, state)
+    return table
+
+
+def distance_source(model):
+    """Return (text, previous text byte kind) of model as in _DISTANCE_MODELS, or
+    None if model is not a tabulable model of the previous encryption."""
+    if not getattr(model, '_has_prev', False):
+        return None
+    return _DISTANCE_MODELS.get(type(getattr(model, 'modelobj', None)))
+
+
+def build_distance_tables(model, bnum, source, prev_byte):
+    """Build the tables of the intermediate value of a distance model.
+
+    The intermediate value (before masking and Hamming weight) of key guess key
+    is cur[v, key] ^ prev[w, key], v being byte bnum of the text and w byte
+    prev_byte of the previous text: with the XOR of the two terms, the value
+    for (v, w) is the one for (v, 0) XORed with the one for (0, w) and (0, 0).
+
+    Args:
+        model (AES128_prev): Leakage model, listed in _DISTANCE_MODELS.
+        bnum (int): Subkey byte number.
+        source (str): 'textin' or 'textout', as given by distance_source().
+        prev_byte (int): Byte of the previous text the model uses.
+
+    Returns:
+        Tuple (cur, prev) of numpy.ndarray of shape (256, numPerms).
+    """
+    numPerms = model.getPermPerSubkey()
+    numbytes = model.getNumSubKeys()
+
+    def leakage(v, w, key):
+        text = [0] * numbytes
+        prev = [0] * numbytes
+        text[bnum] = v
+        prev[prev_byte] = w
+        guess = [0] * numbytes
+        guess[bnum] = key
+        if source == 'textin':
+            return model.modelobj.leakage(text, None, prev, None, guess, bnum)
+        return model.modelobj.leakage(None, text, None, prev, guess, bnum)
+
+    cur = np.zeros((256, numPerms), dtype=np.int64)
+    prev = np.zeros((256, numPerms), dtype=np.int64)
+    for key in range(numPerms):
+        base = leakage(0, 0, key)
+        for v in range(256):
+            cur[v, key] = leakage(v, 0, key)
+            prev[v, key] = leakage(0, v, key) ^ base
+    return cur, prev
+
+
+def previous_texts(texts, last=None):
+    """Texts of the encryption before each trace of a batch.
+
+    Args:
+        texts: Textins (or textouts) of the batch.
+        last: Text of the trace before the batch, None for zeros (first trace).
+
+    Returns:
+        numpy.ndarray, texts shifted by one trace with last first.
+    """
+    texts = np.asarray(texts)
+    prev = np.empty_like(texts)
+    prev[1:] = texts[:-1]
+    prev[0] = 0 if last is None else last
+    return prev
+
+
+def compact_table(table):
+    """Return table as uint8 if all its values are integers in 0..255 (e.g.
+    Hamming weights), which is exact and 8 times smaller; else table itself."""
+    if np.all((table >= 0) & (table <= 255) & (table == np.round(table))):
+        return table.astype(np.uint8)
+    return table
+
+
+def group_sums(traces, inverse):
+    """Number of traces and sum of the traces of every group.
+
+    Args:
+        traces: numtraces x samples array.
+        inverse: Group of every trace (0..numgroups-1, every group non-empty),
+            as returned by LeakageTable.grouped(), or None for one group per trace.
+
+    Returns:
+        Tuple (counts, sums): numgroups vector and numgroups x samples array
+        (float64, or traces itself if inverse is None).
+    """
+    if inverse is None:
+        return np.ones(len(traces), dtype=np.double), traces
+    counts = np.bincount(inverse)
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sums = np.add.reduceat(np.asarray(traces)[order], starts, axis=0, dtype=np.double)
+    return counts.astype(np.double), sums
+
+
+class LeakageTable(object):
+    """Generates the (numtraces x numPerms) hypothesis matrix of one subkey byte.
+
+    Models listed in _TABULATED_MODELS are evaluated once into a lookup table and
+    a whole batch is then a single fancy-index; models listed in _DISTANCE_MODELS
+    into two tables of their intermediate value, XORed per trace. Any other model
+    falls back to calling model.leakage() per trace and per key guess. Integer
+    tables (Hamming weights, byte values) are kept as uint8, see compact_table().
+    """
+    def __init__(self, model, bnum):
+        self.model = model
+        self.bnum = bnum
+        self.numPerms = model.getPermPerSubkey()
+        self.source = table_source(model)
+        if self.source is not None:
+            self.table = compact_table(build_leakage_table(model, bnum, self.source))
+        else:
+            self.table = None
+
+        self.distance = None
+        distance = distance_source(model)
+        if distance is not None:
+            (source, kind) = distance
+            prev_byte = bnum if kind == 'same' else model.modelobj.INVSHIFT_undo[bnum]
+            (cur, prev) = build_distance_tables(model, bnum, source, prev_byte)
+            self.distance = (source, prev_byte, cur, prev)
+            self.hw = compact_table(np.array(model.HW, dtype=np.double))
+
+    def hypotheses(self, plaintexts, ciphertexts, knownkeys, state, prev_pts=None, prev_cts=None):
+        """Hypothetical leakage of every trace for every key guess.
+
+        Args:
+            plaintexts: Textins of the batch.
+            ciphertexts: Textouts of the batch.
+            knownkeys: Known keys of the batch (may be empty).
+            state (dict): Model state, 'knownkey' is overwritten per trace.
+            prev_pts: Textins of the previous encryptions (models with _has_prev),
+                see previous_texts().
+            prev_cts: Textouts of the previous encryptions (models with _has_prev).
+
+        Returns:
+            numpy.ndarray of shape (numtraces, numPerms), uint8 for integer
+            tables (beware of overflows, e.g. np.square()).
+        """
+        if self.table is not None:
+            return self.table[self.text_bytes(plaintexts, ciphertexts)]
+        if self.distance is not None:
+            (source, prev_byte, cur, prev) = self.distance
+            (texts, prev_texts) = (plaintexts, prev_pts) if source == 'textin' else (ciphertexts, prev_cts)
+            value = cur[np.asarray(texts)[:, self.bnum].astype(np.intp)]
+            value ^= prev[np.asarray(prev_texts)[:, prev_byte].astype(np.intp)]
+            return self.hw[value & self.model._mask]
+
+        numtraces = len(plaintexts)
+        hyp = np.zeros((numtraces, self.numPerms), dtype=np.double)
+        for tnum in range(numtraces):
+            pt = plaintexts[tnum]
+            ct = ciphertexts[tnum]
+            if knownkeys is not None and len(knownkeys) > 0:
+                state['knownkey'] = knownkeys[tnum]
+            else:
+                state['knownkey'] = None
+
+            for key in range(self.numPerms):
+                if self.model._has_prev:
+                    hyp[tnum, key] = self.model.leakage(pt, ct, prev_pts[tnum], prev_cts[tnum], key, self.bnum, state)
+                else:
+                    hyp[tnum, key] = self.model.leakage(pt, ct, key, self.bnum, state)
+        return hyp
+
+    def grouped(self, plaintexts, ciphertexts, knownkeys, state, prev_pts=None, prev_cts=None):
+        """Hypotheses of the batch with the traces grouped by hypothesis row.
+
+        With a lookup table the hypotheses of a trace only depend on its text
+        byte, so traces with the same byte share one row: any sum over the
+        traces of f(hypothesis) * trace is a sum over the (at most 256) rows of
+        f(row) * (sum of the traces of the row), see group_sums().
+
+        Returns:
+            Tuple (rows, inverse): rows is numgroups x numPerms, inverse the
+            group of every trace. Without a lookup table rows is the
+            hypotheses() matrix and inverse None (one group per trace).
+        """
+        if self.table is None:
+            return self.hypotheses(plaintexts, ciphertexts, knownkeys, state, prev_pts, prev_cts), None
+        (values, inverse) = np.unique(self.text_bytes(plaintexts, ciphertexts), return_inverse=True)
+        return self.table[values], inverse
+
+    def text_bytes(self, plaintexts, ciphertexts):
+        """Byte bnum of the texts indexing the lookup table (only with a lookup table)."""
+        texts = plaintexts if self.source == 'textin' else ciphertexts
+        return np.asarray(texts)[:, self.bnum].astype(np.intp)
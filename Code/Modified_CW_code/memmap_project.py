@@ -0,0 +1,177 @@
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from chipwhisperer.common.traces import Trace
+from chipwhisperer.common.utils.tracesource import TraceSource
+from chipwhisperer.analyzer.attacks.cpa_algorithms.trace_batches import load_trace_block
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/
+#This file may be simply added to the previously mentioned directory
+
+_FILES = {'waves': 'waves.npy', 'textins': 'textins.npy', 'textouts': 'textouts.npy', 'keys': 'keys.npy'}
+
+
+def convert_project(proj, path, dtype=None, chunk_size=10000):
+    """Write the traces of a project into a memory-mappable, fixed-dtype store.
+
+    The waves, textins, textouts and keys of every trace end up in one .npy
+    file each inside path. Traces are copied chunk_size at a time, so
+    converting never needs more than one chunk in memory.
+
+    Example::
+
+        import chipwhisperer as cw
+        import chipwhisperer.analyzer as cwa
+        from chipwhisperer.analyzer.attacks.memmap_project import convert_project
+        proj = cw.open_project('/path/to/project')
+        mproj = convert_project(proj, '/path/to/project_memmap')
+        attack = cwa.cpa(mproj, cwa.leakage_models.sbox_output)
+        results = attack.run()
+
+    Args:
+        proj (Project): Project (or anything with trace_manager()) to convert.
+        path (str): Directory to write the store into. Created if needed.
+        dtype (numpy.dtype, optional): Sample type of the stored waves.
+            Defaults to the dtype of the project waves.
+        chunk_size (int, optional): Number of traces copied at a time.
+
+    Returns:
+        MemmapProject opened on path.
+    """
+    traceSource = proj.trace_manager()
+    numtraces = len(proj.traces)
+    first = load_trace_block(traceSource, 0, 1)
+    if dtype is None:
+        dtype = first[0].dtype
+
+    os.makedirs(path, exist_ok=True)
+    out = {
+        'waves': open_memmap(os.path.join(path, _FILES['waves']), mode='w+', dtype=dtype,
+                             shape=(numtraces, first[0].shape[1])),
+        'textins': open_memmap(os.path.join(path, _FILES['textins']), mode='w+', dtype=np.uint8,
+                               shape=(numtraces, len(first[1][0]))),
+        'textouts': open_memmap(os.path.join(path, _FILES['textouts']), mode='w+', dtype=np.uint8,
+                                shape=(numtraces, len(first[2][0]))),
+        'keys': open_memmap(os.path.join(path, _FILES['keys']), mode='w+', dtype=np.uint8,
+                            shape=(numtraces, len(first[3][0]))),
+    }
+
+    for tstart in range(0, numtraces, chunk_size):
+        tend = min(tstart + chunk_size, numtraces)
+        (traces, textins, textouts, knownkeys) = load_trace_block(traceSource, tstart, tend)
+        out['waves'][tstart:tend] = traces
+        out['textins'][tstart:tend] = np.asarray(textins)
+        out['textouts'][tstart:tend] = np.asarray(textouts)
+        out['keys'][tstart:tend] = np.asarray(list(knownkeys))
+
+    for arr in out.values():
+        arr.flush()
+    del out
+
+    return MemmapProject(path)
+
+
+class MemmapTraceSource(TraceSource):
+    """Trace source reading a store written by convert_project().
+
+    All arrays are opened with mmap_mode='r': getters and get_trace_block()
+    return views into the mapped files, so pages are only read from disk
+    when the attack touches them.
+    """
+    def __init__(self, path, name="Memory-mapped Traces"):
+        TraceSource.__init__(self, name)
+        self.path = path
+        self.waves = np.load(os.path.join(path, _FILES['waves']), mmap_mode='r')
+        self.textins = np.load(os.path.join(path, _FILES['textins']), mmap_mode='r')
+        self.textouts = np.load(os.path.join(path, _FILES['textouts']), mmap_mode='r')
+        self.keys = np.load(os.path.join(path, _FILES['keys']), mmap_mode='r')
+
+    def get_trace(self, n):
+        return self.waves[n]
+
+    def get_textin(self, n):
+        return self.textins[n]
+
+    def get_textout(self, n):
+        return self.textouts[n]
+
+    def get_known_key(self, n=0):
+        return self.keys[n]
+
+    def get_trace_block(self, tstart, tend):
+        """Return views of the waves, textins, textouts and keys of traces [tstart, tend)."""
+        if tstart < 0 or tend > len(self.waves):
+            raise ValueError("Error: Traces %d-%d are not in mapped range." % (tstart, tend - 1))
+        return (self.waves[tstart:tend], self.textins[tstart:tend],
+                self.textouts[tstart:tend], self.keys[tstart:tend])
+
+    def num_traces(self):
+        return self.waves.shape[0]
+
+    def num_points(self):
+        return self.waves.shape[1]
+
+    getTrace = get_trace
+    getTextin = get_textin
+    getTextout = get_textout
+    getKnownKey = get_known_key
+    numTraces = num_traces
+    numPoints = num_points
+
+
+class _MemmapTraces(object):
+    """proj.traces equivalent: len() and indexing returning Trace tuples."""
+    def __init__(self, source):
+        self._source = source
+
+    def __len__(self):
+        return self._source.num_traces()
+
+    def __getitem__(self, n):
+        return Trace(self._source.waves[n], self._source.textins[n], self._source.textouts[n], self._source.keys[n])
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+
+class MemmapProject(object):
+    """Read-only stand-in for Project over a store written by convert_project().
+
+    Provides what cwa.cpa() and CPA.change_project() use from a project
+    (trace_manager(), traces, waves, textins, textouts and keys), so an attack
+    can run directly over the memory-mapped files.
+    """
+    def __init__(self, path):
+        self._traceManager = MemmapTraceSource(path)
+        self._traces = _MemmapTraces(self._traceManager)
+
+    def trace_manager(self):
+        return self._traceManager
+
+    @property
+    def location(self):
+        return self._traceManager.path
+
+    @property
+    def traces(self):
+        return self._traces
+
+    @property
+    def waves(self):
+        return self._traceManager.waves
+
+    @property
+    def textins(self):
+        return self._traceManager.textins
+
+    @property
+    def textouts(self):
+        return self._traceManager.textouts
+
+    @property
+    def keys(self):
+        return self._traceManager.keys
+
+    def __repr__(self):
+        return "MemmapProject({!r})".format(self.location)
@@ -0,0 +1,166 @@
+import mmap
+import multiprocessing
+import traceback
+import numpy as np
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+
+def _instance_state(inst):
+    # leakage models hold weakrefs and cannot be pickled, the worker keeps them
+    return dict((k, v) for k, v in inst.__dict__.items() if k not in ('model', 'leakage_table'))
+
+
+def _worker(conn, buf, subkey_class, model, bnums, states):
+    cpa = {}
+    for bnum in bnums:
+        cpa[bnum] = subkey_class(model)
+        if bnum in states:
+            cpa[bnum].__dict__.update(states[bnum])
+
+    while True:
+        msg = conn.recv()
+        try:
+            if msg[0] == 'close':
+                conn.send(('ok', dict((bnum, _instance_state(cpa[bnum])) for bnum in bnums)))
+                return
+            if msg[0] == 'state':
+                conn.send(('ok', dict((bnum, _instance_state(cpa[bnum])) for bnum in bnums)))
+                continue
+
+            (_, shape, dtype, textins, textouts, knownkeys, accumulate, want) = msg
+            traces = np.ndarray(shape, dtype=dtype, buffer=buf)
+            out = []
+            for bnum in bnums:
+                (diffs, _) = cpa[bnum].oneSubkey(bnum, None, traces, shape[0], textins, textouts, knownkeys,
+                                                 None, cpa[bnum].modelstate, 0, accumulate)
+                out.append((bnum, diffs() if want else None))
+            conn.send(('ok', out))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+            return
+
+
+class SubkeyProcessPool(object):
+    """Runs the CPAProgressiveOneSubkey instances of an attack in worker processes.
+
+    Subkey bytes are split round-robin over the workers, each worker keeping its
+    own instances (and thus accumulators) for the whole run, starting from the
+    given instance states if any (e.g. when resuming). The traces of a
+    batch are written once into an anonymous shared memory mapping that all
+    workers read, only the (small) texts and keys are pickled per batch, and
+    every worker sends back the diffs of its bytes when they are asked for.
+
+    Workers are forked so that they inherit the leakage model, which cannot be
+    pickled. Create the pool before starting any other thread (e.g. the trace
+    prefetcher).
+
+    Args:
+        subkey_class: CPAProgressiveOneSubkey class to instantiate per byte.
+        model: Leakage model of the attack.
+        bnums (list): Subkey bytes to attack.
+        processes (int): Number of worker processes.
+        max_traces (int): Maximum number of traces in a batch.
+        numpoints (int): Number of (cropped) samples per trace.
+        dtype (numpy.dtype): Sample type of the traces.
+        states (dict, optional): Maps subkey bytes to the instance state
+            (attributes) their worker starts from.
+    """
+    def __init__(self, subkey_class, model, bnums, processes, max_traces, numpoints, dtype, states=None):
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            raise ValueError("Parallel subkeys need the 'fork' start method, not available on this platform")
+
+        self.dtype = np.dtype(dtype)
+        self.capacity = (max_traces, numpoints)
+        self._buf = mmap.mmap(-1, max(1, max_traces * numpoints * self.dtype.itemsize))
+
+        bnums = list(bnums)
+        processes = max(1, min(processes, len(bnums)))
+        self._conns = []
+        self._procs = []
+        for i in range(processes):
+            (parent_conn, child_conn) = ctx.Pipe()
+            p = ctx.Process(target=_worker, args=(child_conn, self._buf, subkey_class, model, bnums[i::processes], states or {}),
+                            daemon=True)
+            p.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(p)
+
+    def _recv(self, conn):
+        (status, payload) = conn.recv()
+        if status != 'ok':
+            self.terminate()
+            raise RuntimeError("Subkey worker failed:\n" + payload)
+        return payload
+
+    def process(self, traces, textins, textouts, knownkeys, pointRange, accumulate, want=True):
+        """Feed one batch to all workers.
+
+        Args:
+            want (bool, optional): Compute and send back the diffs. If False the
+                batch is only accumulated.
+
+        Returns:
+            dict mapping each subkey byte to its diffs after the batch (None
+            if not wanted).
+        """
+        if pointRange is not None:
+            traces = traces[:, pointRange[0]:pointRange[1]]
+        if traces.shape[0] > self.capacity[0] or traces.shape[1] != self.capacity[1]:
+            raise ValueError("Batch of shape %s does not fit the shared buffer %s" % (traces.shape, self.capacity))
+
+        shared = np.ndarray(traces.shape, dtype=self.dtype, buffer=self._buf)
+        shared[:] = traces
+
+        msg = ('batch', traces.shape, self.dtype.str, textins, textouts, knownkeys, accumulate, want)
+        for conn in self._conns:
+            conn.send(msg)
+
+        results = {}
+        for conn in self._conns:
+            for (bnum, diffs) in self._recv(conn):
+                results[bnum] = diffs
+        return results
+
+    def _collect(self, cpa, msg):
+        for conn in self._conns:
+            conn.send(msg)
+        for conn in self._conns:
+            for (bnum, state) in self._recv(conn).items():
+                cpa[bnum].__dict__.update(state)
+
+    def snapshot(self, cpa):
+        """Copy the current per-byte state of the workers into cpa[bnum]."""
+        self._collect(cpa, ('state',))
+
+    def close(self, cpa):
+        """Stop the workers and copy their final per-byte state into cpa[bnum]."""
+        self._collect(cpa, ('close',))
+        for p in self._procs:
+            p.join()
+        self._buf.close()
+
+    def terminate(self):
+        for p in self._procs:
+            if p.is_alive():
+                p.terminate()
+
+
+def start_subkey_pool(subkey_class, model, bnums, processes, traceSource, tracerange, pointRange, interval, cpa=None):
+    """Create a SubkeyProcessPool sized for the batches of an attack.
+
+    The sample count and type are taken from the first trace of tracerange.
+    If cpa is given, the workers start from the state of cpa[bnum].
+    """
+    first = traceSource.get_trace(tracerange[0])
+    if pointRange is not None:
+        first = first[pointRange[0]:pointRange[1]]
+    states = None
+    if cpa is not None:
+        states = dict((bnum, _instance_state(cpa[bnum])) for bnum in bnums)
+    return SubkeyProcessPool(subkey_class, model, bnums, processes, interval, len(first), np.asarray(first).dtype,
+                             states)
@@ -0,0 +1,108 @@
+import numpy as np
+from chipwhisperer.analyzer.attacks.cpa_algorithms.leakage_tables import LeakageTable, previous_texts
+from chipwhisperer.analyzer.attacks.cpa_algorithms.trace_batches import load_trace_block, previous_text
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+
+def top_points(score, count, window=0):
+    """Sorted indices of the count highest scores, each widened by window samples on both sides."""
+    score = np.where(np.isnan(score), -np.inf, score)
+    count = min(count, len(score))
+    best = np.argpartition(-score, count - 1)[:count]
+    if window > 0:
+        best = (best[:, None] + np.arange(-window, window + 1)).ravel()
+        best = best[(best >= 0) & (best < len(score))]
+    return np.unique(best)
+
+
+def variance_score(traces):
+    """Variance of every sample point."""
+    return np.var(traces, axis=0, dtype=np.double)
+
+
+def snr_score(traces, labels):
+    """Signal-to-noise ratio of every sample point: variance of the mean trace of
+    every label value, over the mean variance of the traces within a label value."""
+    (_, group) = np.unique(labels, return_inverse=True)
+    counts = np.bincount(group).astype(np.double)
+    onehot = np.zeros((len(group), len(counts)))
+    onehot[np.arange(len(group)), group] = 1
+    traces = np.asarray(traces, dtype=np.double)
+    means = np.dot(onehot.T, traces) / counts[:, None]
+    variances = np.dot(onehot.T, np.square(traces)) / counts[:, None] - np.square(means)
+    weights = counts / counts.sum()
+    signal = np.dot(weights, np.square(means)) - np.square(np.dot(weights, means))
+    noise = np.dot(weights, variances)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return signal / noise
+
+
+def correlation_score(traces, hyps):
+    """Highest absolute correlation of every sample point over all key guesses."""
+    traces = np.asarray(traces, dtype=np.double)
+    hyps = np.asarray(hyps, dtype=np.double)
+    ct = traces - traces.mean(axis=0)
+    ch = hyps - hyps.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.dot(ch.T, ct) / np.sqrt(np.outer(np.sum(np.square(ch), axis=0), np.sum(np.square(ct), axis=0)))
+    return np.nanmax(np.fabs(corr), axis=0)
+
+
+def select_points(traceSource, model, bnums, trace_range, point_range=None, method='cpa', count=50,
+                  num_traces=500, window=0):
+    """Points of interest of every subkey byte, from a first pass over a prefix of the traces.
+
+    Args:
+        traceSource: Trace source to read the traces from.
+        model: Leakage model of the attack.
+        bnums (list): Subkey bytes to select points for.
+        trace_range (list): [start, end) traces of the attack; the first
+            num_traces of them are used.
+        point_range (list, optional): [start, end) sample points of the attack.
+            The returned indices are relative to its start.
+        method (str, optional): 'cpa' (highest correlation of any key guess),
+            'snr' (SNR of the leakage of the known key) or 'variance' (highest
+            variance, the same points for every byte).
+        count (int, optional): Number of points per byte (before widening).
+        num_traces (int, optional): Number of traces of the first pass.
+        window (int, optional): Also keep the window samples around every point.
+
+    Returns:
+        dict mapping each byte of bnums to a sorted numpy array of sample indices.
+    """
+    tstart = trace_range[0]
+    tend = min(trace_range[1], tstart + num_traces)
+    (traces, textins, textouts, knownkeys) = load_trace_block(traceSource, tstart, tend)
+    if point_range is not None:
+        traces = traces[:, point_range[0]:point_range[1]]
+
+    if method == 'variance':
+        points = top_points(variance_score(traces), count, window)
+        return dict((bnum, points) for bnum in bnums)
+    if method not in ('cpa', 'snr'):
+        raise ValueError("Unknown point of interest selection method %r" % method)
+    if method == 'snr' and len(knownkeys) == 0:
+        raise ValueError("SNR point selection needs the known key of the traces")
+
+    last = previous_text(traceSource, tstart) or (None, None)
+    prev_pts = previous_texts(textins, last[0])
+    prev_cts = previous_texts(textouts, last[1])
+    points = {}
+    for bnum in bnums:
+        hyps = LeakageTable(model, bnum).hypotheses(textins, textouts, knownkeys, {'knownkey': None}, prev_pts, prev_cts)
+        if method == 'cpa':
+            score = correlation_score(traces, hyps)
+        else:
+            known = model.process_known_key(knownkeys[0])[bnum]
+            score = snr_score(traces, hyps[:, known])
+        points[bnum] = top_points(score, count, window)
+    return points
+
+
+def same_points(a, b):
+    """Whether two point of interest selections (arrays or None for all the samples) are equal."""
+    if a is None or b is None:
+        return a is None and b is None
+    return np.array_equal(a, b)
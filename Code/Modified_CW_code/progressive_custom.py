@@ -1,11 +1,50 @@
 import numpy as np
 import math
 from chipwhisperer.analyzer.attacks.algorithmsbase import AlgorithmsBase
+from chipwhisperer.analyzer.attacks.cpa_algorithms.leakage_tables import LeakageTable, group_sums, previous_texts, table_source
+from chipwhisperer.analyzer.attacks.cpa_algorithms.trace_batches import TraceBlockReader, previous_text
+from chipwhisperer.analyzer.attacks.cpa_algorithms.parallel_subkeys import start_subkey_pool
+from chipwhisperer.analyzer.attacks.cpa_algorithms.accumulator_state import AccumulatorState, check_mergeable
+from chipwhisperer.analyzer.attacks.cpa_algorithms.checkpoint import Checkpoint
+from chipwhisperer.analyzer.attacks.cpa_algorithms.history import HistoryRecorder
+from chipwhisperer.analyzer.attacks.cpa_algorithms.convergence import ConvergenceMonitor
+from chipwhisperer.analyzer.attacks.cpa_algorithms.poi import same_points
 import IPython as ip
 
+def single_batch_sumht(rows, counts, sums):
+    """Sum of hyp*trace over a batch for every key guess (numPerms x samples) with a float32 GEMM.
+
+    The batch is given grouped as by LeakageTable.grouped() and group_sums():
+    hypothesis rows, number of traces and sum of the traces of every group.
+    The GEMM is done on the batch centered on float32 means a and b, the rest of
+    sum(h*t) = sum((h-a)*(t-b)) + a*sum(t) + b*sum(h) - n*a*b is added in float64,
+    so the float32 rounding is relative to the covariance of the batch and not
+    to the (much larger) raw products. The running sums themselves must stay
+    float64, they cancel in sumnum and sumden. With the 'Accumulator Precision'
+    parameter at float32 the correlations are within 1e-6 of the float64 ones
+    (about 1e-7 after 50k traces in batches of 100).
+    """
+    n = counts.sum()
+    sumh = np.dot(counts, np.asarray(rows, dtype=np.double))
+    sumt = np.sum(sums, axis=0, dtype=np.double)
+    a = (sumh / n).astype(np.float32)
+    b = (sumt / n).astype(np.float32)
+    (a64, b64) = (a.astype(np.double), b.astype(np.double))
+    sumht = np.outer(a64, sumt) + np.outer(sumh - n * a64, b64)
+    centered_sums = np.asarray(sums - np.outer(counts, b64), dtype=np.float32)
+    sumht += np.dot((np.asarray(rows, dtype=np.float32) - a).T, centered_sums)
+    return sumht
+
+def _accumulate(total, batch):
+    #The sums start as lists of zeros, they get their shape from the first batch
+    if isinstance(total, list):
+        return np.array(batch, dtype=np.double)
+    total += batch
+    return total
+
 class CPAProgressiveOneSubkey:
     """This class is the CUSTOMIZED basic progressive CPA attack, capable of adding traces onto a variable with previous data"""
-    def __init__(self, model):
+    def __init__(self, model, history=None):
         self.model = model
         self.sumhq = [0] * self.model.getPermPerSubkey()
         self.sumtq = [0]
@@ -14,99 +53,199 @@ class CPAProgressiveOneSubkey:
         self.sumht = [0] * self.model.getPermPerSubkey()
         self.totalTraces = 0
         self.modelstate = {'knownkey': None}
-
-
-        
-    # Lists to store tuples of (sumden1, sumden2) and diffs for each bnum iteration
-        self.stored_sumden_pairs = []
-        self.stored_diffs = []
+        self.leakage_table = None
+        #Sample points of interest (indices into the cropped traces), None for all of them
+        self.points = None
+        #float32 batch products (the sums stay float64), see single_batch_sumht()
+        self.single = False
+        #Partition mode: only the traces sums per value of the text byte are accumulated,
+        #the per key guess sums are derived from them with the leakage table (see _key_sums())
+        self.partition = False
+        self.bnum = None
+        self.text_counts = np.zeros(256)
+        self.text_sums = None
+        #(textin, textout) of the trace before the next batch, for models of the previous encryption
+        self.prev_text = None
+
+        #Bounded history of (sumden1, sumden2) and diffs for the batches being recorded
+        self.history = history if history is not None else HistoryRecorder().subkey()
+
+    @property
+    def stored_sumden_pairs(self):
+        """Recorded (sumden1, bnum, key, sumden2) tuples."""
+        return self.history.tuples()
+
+    @property
+    def stored_diffs(self):
+        """Recorded (diffs, bnum, key) tuples, only kept with HistoryRecorder(diffs=True)."""
+        return self.history.diffs_tuples()
 
     def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt, accumulate_sumdens):
-        diffs = [0] * self.model.getPermPerSubkey()
         self.totalTraces += numtraces
 
         if pointRange is None:
             traces = traces_all
         else:
             traces = traces_all[:, pointRange[0]:pointRange[1]]
-
+        if self.points is not None:
+            traces = traces[:, self.points]
 
         self.sumtq += np.sum(np.square(traces), axis=0, dtype=np.double)
         self.sumt += np.sum(traces, axis=0, dtype=np.double)
-        sumden2 = np.square(self.sumt) - self.totalTraces * self.sumtq
-        sumden2_normalized = sumden2 / (self.totalTraces - 1)
-
-        #For each 0..0xFF possible value of the key byte
-        for key in range(0, self.model.getPermPerSubkey()):
-            #Initialize arrays & variables to zero
-            sumnum = np.zeros(len(traces[0, :]))
-            hyp = [0] * numtraces
-
-            #Formula for CPA & description found in "Power Analysis Attacks"
-            # by Mangard et al, page 124, formula 6.2.
-            #
-            # This has been modified to reduce computational requirements such that adding a new waveform
-            # doesn't require you to recalculate everything
-            prev_cts = np.insert(ciphertexts[:-1], 0, 0, axis=0)
-            prev_pts = np.insert(plaintexts[:-1], 0, 0, axis=0)
-            
-            #Generate hypotheticals
-            for tnum in range(numtraces):
-                if len(plaintexts) > 0:
-                    pt = plaintexts[tnum]
-
-                if len(ciphertexts) > 0:
-                    ct = ciphertexts[tnum]
-
-                if len(prev_cts) > 0:
-                    prev_ct = prev_cts[tnum]
-
-                if len(prev_pts) > 0:
-                    prev_pt = prev_pts[tnum]
-
-                if knownkeys and len(knownkeys) > 0:
-                    nk = knownkeys[tnum]
-                else:
-                    nk = None
-
-                state['knownkey'] = nk
-
-                if self.model._has_prev:
-                    hypint = self.model.leakage(pt, ct, prev_pt, prev_ct, key, bnum, state)
-                else:
-                    hypint = self.model.leakage(pt, ct, key, bnum, state)
-
-                hyp[tnum] = hypint
-
-            hyp = np.array(hyp)
-
-            self.sumh[key] += np.sum(hyp, axis=0, dtype=np.double)
-            self.sumht[key] += np.sum(np.multiply(np.transpose(traces), hyp), axis=1, dtype=np.double)
-
-            sumnum = self.totalTraces * self.sumht[key] - self.sumh[key] * self.sumt
-
-            self.sumhq[key] += np.sum(np.square(hyp), axis=0, dtype=np.double)
-
-            sumden1 = (np.square(self.sumh[key]) - self.totalTraces * self.sumhq[key])
-            sumden1_normalized = sumden1 / (self.totalTraces - 1)
-
-
-            # Store tuple (sumden1, bnum, key sumden2) in list
-
-            
-            sumden = sumden1 * sumden2
 
-            diffs[key] = sumnum / np.sqrt(sumden)
-
-            if accumulate_sumdens:
-                self.stored_sumden_pairs.append((sumden1_normalized, bnum, key, sumden2_normalized))
-                self.stored_diffs.append((diffs.copy(), bnum, key))
-
-            if progressBar:
-                progressBar.updateStatus(pbcnt, (self.totalTraces - numtraces, self.totalTraces - 1, bnum))
-            pbcnt += 1
-
-        return (diffs, pbcnt)
+        #Formula for CPA & description found in "Power Analysis Attacks"
+        # by Mangard et al, page 124, formula 6.2.
+        #
+        # This has been modified to reduce computational requirements such that adding a new waveform
+        # doesn't require you to recalculate everything. A batch only updates the sums, the
+        # correlations are computed by correlation() when they are needed (see Results.update_subkey())
+        (prev_pts, prev_cts) = self._previous_texts(plaintexts, ciphertexts)
+
+        if self.leakage_table is None:
+            self.leakage_table = LeakageTable(self.model, bnum)
+        self.bnum = bnum
+
+        if self.partition:
+            #One scatter of the batch into the per text byte sums, O(batch x samples)
+            (values, inverse) = np.unique(self.leakage_table.text_bytes(plaintexts, ciphertexts), return_inverse=True)
+            (counts, sums) = group_sums(traces, inverse)
+            if self.text_sums is None:
+                self.text_sums = np.zeros((256, traces.shape[1]))
+            self.text_counts[values] += counts
+            self.text_sums[values] += sums
+        else:
+            #Generate hypotheticals for every key guess at once, one row per group of
+            #traces sharing them (same text byte, see LeakageTable.grouped()): the batch
+            #sums are then weighted sums over at most 256 rows instead of all the traces
+            (rows, inverse) = self.leakage_table.grouped(plaintexts, ciphertexts, knownkeys, state, prev_pts, prev_cts)
+            (counts, sums) = group_sums(traces, inverse)
+            rows64 = np.asarray(rows, dtype=np.double)
+            if self.single:
+                batch_sumht = single_batch_sumht(rows, counts, sums)
+            else:
+                batch_sumht = np.dot(rows64.T, sums)
+            self.sumh = _accumulate(self.sumh, np.dot(counts, rows64))
+            self.sumhq = _accumulate(self.sumhq, np.dot(counts, np.square(rows64)))
+            self.sumht = _accumulate(self.sumht, batch_sumht)
+
+        pbcnt += self.model.getPermPerSubkey()
+        if progressBar:
+            progressBar.updateStatus(pbcnt - 1, (self.totalTraces - numtraces, self.totalTraces - 1, bnum))
+
+        # Store (sumden1, bnum, key, sumden2) of the selected keys
+        if accumulate_sumdens:
+            (sumh, sumhq, _) = self._key_sums(sumht=False)
+            sumden1s = (np.square(sumh) - self.totalTraces * sumhq) / (self.totalTraces - 1)
+            sumden2 = np.square(self.sumt) - self.totalTraces * self.sumtq
+            sumden2_normalized = sumden2 / (self.totalTraces - 1)
+            known = None
+            if self.history.recorder.keys == 'known' and len(knownkeys) > 0:
+                known = self.model.process_known_key(knownkeys[-1])[bnum]
+            self.history.record(bnum, self.totalTraces, sumden1s, sumden2_normalized, self.correlation, known)
+
+        return (self.correlation, pbcnt)
+
+    def _previous_texts(self, plaintexts, ciphertexts):
+        """Texts of the encryption before each trace of the batch (None unless the model has
+        _has_prev), the first trace taking the last one of the previous batch."""
+        if not getattr(self.model, '_has_prev', False):
+            return (None, None)
+        last = self.prev_text if self.prev_text is not None else (None, None)
+        prev = (previous_texts(plaintexts, last[0]), previous_texts(ciphertexts, last[1]))
+        self.prev_text = (np.array(plaintexts[-1]), np.array(ciphertexts[-1]))
+        return prev
+
+    def _key_sums(self, sumht=True):
+        """sumh, sumhq and sumht (None if not sumht) of every key guess as arrays.
+
+        In partition mode they are derived from the per text byte sums: the
+        hypothesis of a trace only depends on its text byte, so e.g.
+        sumht[key] = sum over the byte values v of table[v, key] * text_sums[v].
+        """
+        if not self.partition:
+            return np.asarray(self.sumh), np.asarray(self.sumhq), np.asarray(self.sumht) if sumht else None
+        if self.leakage_table is None:
+            self.leakage_table = LeakageTable(self.model, self.bnum)
+        table = self.leakage_table.table
+        table64 = np.asarray(table, dtype=np.double)
+        sumh = np.dot(self.text_counts, table64)
+        sumhq = np.dot(self.text_counts, np.square(table64))
+        if not sumht:
+            return sumh, sumhq, None
+        if self.single:
+            return sumh, sumhq, single_batch_sumht(table, self.text_counts, self.text_sums)
+        return sumh, sumhq, np.dot(table64.T, self.text_sums)
+
+    def _sum_names(self):
+        if self.partition:
+            return ('sumt', 'sumtq', 'text_counts', 'text_sums')
+        return ('sumt', 'sumtq', 'sumh', 'sumhq', 'sumht')
+
+    def get_state(self):
+        """Return a copy of the accumulated sums (plain numbers and numpy arrays)."""
+        state = {'totalTraces': self.totalTraces}
+        for name in self._sum_names():
+            value = getattr(self, name)
+            state[name] = np.array(value if value is not None else [], dtype=np.double)
+        if self.points is not None:
+            state['points'] = np.array(self.points, dtype=np.intp)
+        return state
+
+    def _check_partition(self, state):
+        #Sums per text byte and sums per key guess cannot be mixed, the mode comes from 'Accumulation'
+        if self.partition != ('text_sums' in state):
+            raise ValueError("Sums of subkey %s are %s, the algorithm accumulates %s (check 'Accumulation')"
+                             % (self.bnum, "per key guess" if self.partition else "per text byte",
+                                "per text byte" if self.partition else "per key guess"))
+
+    def set_state(self, state):
+        """Restore sums returned by get_state(), accumulated in the same partition mode."""
+        self._check_partition(state)
+        self.totalTraces = int(state['totalTraces'])
+        self.points = np.array(state['points'], dtype=np.intp) if 'points' in state else None
+        if self.totalTraces == 0:
+            #Nothing accumulated yet, the sums only get their shape from the first batch
+            self.sumt = [0]
+            self.sumtq = [0]
+            self.sumh = [0] * self.model.getPermPerSubkey()
+            self.sumhq = [0] * self.model.getPermPerSubkey()
+            self.sumht = [0] * self.model.getPermPerSubkey()
+            self.text_counts = np.zeros(256)
+            self.text_sums = None
+            return
+        for name in self._sum_names():
+            setattr(self, name, np.array(state[name], dtype=np.double))
+
+    def merge_state(self, state):
+        """Add the sums of another run over different traces (get_state() of it).
+
+        The sums are plain sums over the traces, so merging is exact."""
+        self._check_partition(state)
+        if state['totalTraces'] == 0:
+            return
+        if self.totalTraces == 0:
+            self.set_state(state)
+            return
+        if not same_points(self.points, state.get('points')):
+            raise ValueError("Cannot merge sums over different points of interest")
+        current = self.get_state()
+        for name in self._sum_names():
+            setattr(self, name, current[name] + state[name])
+        self.totalTraces += int(state['totalTraces'])
+
+    def correlation(self):
+        """Correlation of every key guess (numPerms x samples) from the current sums.
+
+        oneSubkey() returns this method instead of its result, so that the
+        correlations are only computed when someone reads them."""
+        if self.totalTraces == 0:
+            return [0] * self.model.getPermPerSubkey()
+        sumt = np.asarray(self.sumt)
+        (sumh, sumhq, sumht) = self._key_sums()
+        sumnum = self.totalTraces * sumht - np.outer(sumh, sumt)
+        sumden1 = np.square(sumh) - self.totalTraces * sumhq
+        sumden2 = np.square(sumt) - self.totalTraces * np.asarray(self.sumtq)
+        return sumnum / np.sqrt(np.outer(sumden1, sumden2))
 
 class CPAProgressiveCustom(AlgorithmsBase):
     """CPA Attack done as a loop, using an algorithm which can progressively add traces & give output stats"""
@@ -116,63 +255,273 @@ class CPAProgressiveCustom(AlgorithmsBase):
         AlgorithmsBase.__init__(self)
         super().__init__()
         self.subkey_instances = []  # Added to store CPAProgressiveOneSubkey instances
+        self._cpa = []
+        self._traceRanges = []
+        self._pointRange = None
+        self._checkpointPath = None
+        self._checkpointEvery = 10
+        self._resume = None
+        self._history = HistoryRecorder()
+        self._earlyStop = None
+        self._monitor = None
+        self._points = None
 
         self.getParams().addChildren([
             {'name': 'Iteration Mode', 'key': 'itmode', 'type': 'list', 'values': {'Depth-First': 'df', 'Breadth-First': 'bf'}, 'value': 'bf', 'action': self.updateScript},
             {'name': 'Skip when PGE=0', 'key': 'checkpge', 'type': 'bool', 'value': False, 'action': self.updateScript},
+            {'name': 'Prefetch Depth', 'key': 'prefetch', 'type': 'int', 'value': 1, 'limits': (0, 64), 'action': self.updateScript},
+            {'name': 'Worker Processes', 'key': 'workers', 'type': 'int', 'value': 0, 'limits': (0, 256), 'action': self.updateScript},
+            {'name': 'Accumulator Precision', 'key': 'precision', 'type': 'list', 'values': {'float64': 'double', 'float32': 'single'}, 'value': 'double', 'action': self.updateScript},
+            {'name': 'Accumulation', 'key': 'accumulation', 'type': 'list', 'values': {'Per key guess': 'key', 'Per text byte': 'text'}, 'value': 'key', 'action': self.updateScript},
+            {'name': 'Reporting Stride', 'key': 'stride', 'type': 'int', 'value': 1, 'limits': (1, 1000000), 'action': self.updateScript},
         ])
         self.updateScript()
 
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
-        numtraces = tracerange[1] - tracerange[0] + 1
+        #tracerange is [start, end), as set by CPA.change_project() (shards must not overlap)
+        numtraces = tracerange[1] - tracerange[0]
         pbcnt = 0
         cpa = [None] * (max(self.brange) + 1)
         for bnum in self.brange:
-            cpa_instance = CPAProgressiveOneSubkey(self.model)
+            cpa_instance = CPAProgressiveOneSubkey(self.model, self._history.subkey(len(self.brange)))
             cpa[bnum] = cpa_instance
             self.subkey_instances.append(cpa_instance)  # Track the instance
-        for bnum_df in [0]:
-            tstart = 0
-            tend = self._reportingInterval
-
-            while tstart < numtraces:
-                if tend > numtraces:
-                    tend = numtraces
-
-                data = []
-                textins = []
-                textouts = []
-                knownkeys = []
-                for i in range(tstart, tend):
-                    tnum = i + tracerange[0]
-                    try:
-                        data.append(traceSource.get_trace(tnum))
-                        textins.append(traceSource.get_textin(tnum))
-                        textouts.append(traceSource.get_textout(tnum))
-                        knownkeys.append(traceSource.get_known_key(tnum))
-                    except Exception as e:
-                        if progressBar:
-                            progressBar.abort(e.message)
-                        return
-
-                traces = np.array(data)
-                textins = np.array(textins)
-                textouts = np.array(textouts)
-
-                for bnum_bf in self.brange:
-                    #Chnage values according to the interval of traces that we want to study
-                    accumulate_sumdens = False
-                    if tstart >=0 and tend <= 5000:   # Error interval for ECG data is [18500, 46975]
-                        accumulate_sumdens = True
-                    (data, pbcnt) = cpa[bnum_bf].oneSubkey(
-                        bnum_bf, pointRange, traces, tend - tstart, textins, textouts, knownkeys, progressBar, cpa[bnum_bf].modelstate, pbcnt, accumulate_sumdens
-                    )
-                    self.stats.update_subkey(bnum_bf, data, tnum=tend)
-
-                tend += self._reportingInterval
-                tstart += self._reportingInterval
-                if self.sr:
-                    self.sr()
+        self._cpa = cpa
+        self._traceRanges = [list(tracerange)]
+        self._pointRange = pointRange
+        single = self.findParam('precision').getValue() == 'single'
+        partition = self._partition()
+        for bnum in self.brange:
+            cpa[bnum].points = self._subkey_points(bnum)
+            cpa[bnum].single = single
+            cpa[bnum].partition = partition
+            cpa[bnum].bnum = bnum
+            self.stats.set_points(bnum, cpa[bnum].points)
+
+        #Continue from a checkpoint: restore the sums and results, each byte then
+        #only reads the traces it has not accumulated yet
+        if self._resume is not None:
+            resume = self._resume
+            self._resume = None
+            resume.check(__name__, tracerange, pointRange)
+            for bnum in self.brange:
+                if bnum in resume.state.subkeys:
+                    cpa[bnum].set_state(resume.state.subkeys[bnum])
+                    if not same_points(cpa[bnum].points, self._subkey_points(bnum)):
+                        raise ValueError("Checkpoint of subkey %d is over different points of interest" % bnum)
+                if cpa[bnum].totalTraces > 0:
+                    self.stats.update_subkey(bnum, cpa[bnum].correlation, tnum=cpa[bnum].totalTraces)
+            self.stats.set_state(resume.results)
+
+        #Models of the previous encryption carry the texts of the last trace over from batch to
+        #batch, the first batch of each byte takes the ones of the trace before it
+        if getattr(self.model, '_has_prev', False):
+            for bnum in self.brange:
+                cpa[bnum].prev_text = previous_text(traceSource, tracerange[0] + cpa[bnum].totalTraces)
+
+        #bf specifies a 'breadth-first' search. bf means we search across each
+        #subkey by only the amount of traces specified, reading each batch once
+        #for all subkeys. Depth-First means we search each subkey completely,
+        #then move onto the next.
+        bf = self.findParam('itmode').getValue() == 'bf'
+        if bf:
+            brange_df = [0]
+            brange_bf = self.brange
+        else:
+            brange_bf = [0]
+            brange_df = self.brange
+
+        prefetch = self.findParam('prefetch').getValue()
+
+        #Worker processes attack the subkeys in parallel on each batch (always breadth-first).
+        #The pool forks, so it must be started before the prefetch thread
+        workers = self.findParam('workers').getValue()
+        pool = None
+        if workers > 0:
+            brange_df = [0]
+            pool = start_subkey_pool(CPAProgressiveOneSubkey, self.model, self.brange, workers,
+                                     traceSource, tracerange, pointRange, self._reportingInterval, cpa)
+
+        #Early stopping, see set_early_stop(). 'Skip when PGE=0' stops each byte as
+        #soon as the known key is its best guess
+        monitor = None
+        if self._earlyStop is not None:
+            monitor = ConvergenceMonitor(*self._earlyStop)
+        elif self.findParam('checkpge').getValue():
+            monitor = ConvergenceMonitor(1, use_known_key=True)
+        self._monitor = monitor
+
+        #The callback is only called every 'Reporting Stride' batches (and after the last one). Correlations
+        #are computed when the statistics are read, so batches in between only accumulate
+        stride = self.findParam('stride').getValue()
+
+        nbatch = 0
+        try:
+            for bnum_df in brange_df:
+                group = self.brange if (bf or pool is not None) else [bnum_df]
+                done = min(cpa[bnum].totalTraces for bnum in group)
+                #Workers accumulate every batch into all the bytes, so resuming needs them at the same trace
+                if pool is not None and any(cpa[bnum].totalTraces != done for bnum in group):
+                    raise ValueError("Cannot resume with worker processes, the subkeys of the checkpoint "
+                                     "are at different traces (resume with 'Worker Processes' = 0)")
+                reader = TraceBlockReader(traceSource, tracerange[0], numtraces, self._reportingInterval, prefetch, done)
+
+                for (tstart, tend, (traces, textins, textouts, knownkeys)) in reader:
+                    #Which batches get their sumdens stored is set by the HistoryRecorder (see set_history()),
+                    #by default the traces in [0, 5000]. Error interval for ECG data is [18500, 46975]
+                    accumulate_sumdens = self._history.wants(tstart, tend, self._reportingInterval)
+
+                    report = self.sr is not None and ((nbatch + 1) % stride == 0 or tend == numtraces)
+
+                    if pool is not None:
+                        #Workers only send the correlations back when they are read
+                        want = report or monitor is not None
+                        results = pool.process(traces, textins, textouts, knownkeys, pointRange, accumulate_sumdens, want)
+                        for bnum in self.brange:
+                            if want:
+                                self.stats.update_subkey(bnum, results[bnum], tnum=tend)
+                            #With worker processes bytes are not stopped one by one, only the whole run
+                            if monitor is not None:
+                                monitor.set_known_key(self.stats, self.model, knownkeys)
+                                monitor.update(self.stats, bnum, tend)
+                        pbcnt += len(self.brange) * self.model.getPermPerSubkey()
+                    else:
+                        for bnum_bf in brange_bf:
+                            if not bf:
+                                bnum_bf = bnum_df
+                            #Skip converged bytes, and bytes that already have this batch (resuming)
+                            if monitor is not None and monitor.converged(bnum_bf):
+                                continue
+                            if cpa[bnum_bf].totalTraces >= tend:
+                                continue
+                            (data, pbcnt) = cpa[bnum_bf].oneSubkey(
+                                bnum_bf, pointRange, traces, tend - tstart, textins, textouts, knownkeys, progressBar, cpa[bnum_bf].modelstate, pbcnt, accumulate_sumdens
+                            )
+                            self.stats.update_subkey(bnum_bf, data, tnum=tend)
+                            if monitor is not None:
+                                monitor.set_known_key(self.stats, self.model, knownkeys)
+                                monitor.update(self.stats, bnum_bf, cpa[bnum_bf].totalTraces)
+
+                    stop = monitor is not None and monitor.all_converged(group)
+                    if self.sr and (report or stop):
+                        #The callback may read the trace source too (e.g. known_key())
+                        with reader.lock:
+                            self.sr()
+
+                    nbatch += 1
+                    if self._checkpointPath and nbatch % self._checkpointEvery == 0:
+                        if pool is not None:
+                            pool.snapshot(cpa)
+                        self._save_checkpoint(cpa, tracerange)
+
+                    if stop:
+                        break
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+
+        if pool is not None:
+            pool.close(cpa)
+            for bnum in self.brange:
+                self.stats.update_subkey(bnum, cpa[bnum].correlation, tnum=cpa[bnum].totalTraces)
+        for bnum in self.brange:
+            cpa[bnum].history.flush()
+        if self._checkpointPath:
+            self._save_checkpoint(cpa, tracerange)
+
+    def get_state(self):
+        """Accumulated sums of the last addTraces() (or merge_states()) as an AccumulatorState."""
+        subkeys = dict((bnum, inst.get_state()) for (bnum, inst) in enumerate(self._cpa) if inst is not None)
+        return AccumulatorState(__name__, self._traceRanges, self._pointRange, subkeys)
+
+    def merge_states(self, states):
+        """Merge the states of runs over disjoint trace ranges and update the statistics.
+
+        The results are those of a single run over all the traces. Call setModel()
+        and set_target_subkeys() first; subkeys missing from a state are taken
+        from the others.
+
+        Args:
+            states (list): AccumulatorState instances or paths of saved states.
+
+        Returns:
+            The merged AccumulatorState.
+        """
+        (states, trace_ranges, point_range) = check_mergeable(states, __name__)
+        cpa = [None] * (max(self.brange) + 1)
+        for bnum in self.brange:
+            cpa[bnum] = CPAProgressiveOneSubkey(self.model)
+            cpa[bnum].single = self.findParam('precision').getValue() == 'single'
+            cpa[bnum].partition = self._partition()
+            cpa[bnum].bnum = bnum
+            for state in states:
+                if bnum in state.subkeys:
+                    cpa[bnum].merge_state(state.subkeys[bnum])
+            self.subkey_instances.append(cpa[bnum])
+            self.stats.set_points(bnum, cpa[bnum].points)
+            self.stats.update_subkey(bnum, cpa[bnum].correlation, tnum=cpa[bnum].totalTraces)
+        self._cpa = cpa
+        self._traceRanges = trace_ranges
+        self._pointRange = point_range
+        return self.get_state()
+
+    def set_checkpoint(self, path, every=10):
+        """Save a Checkpoint into path every `every` batches of addTraces() and
+        when it ends. path None disables checkpointing."""
+        self._checkpointPath = path
+        self._checkpointEvery = every
+
+    def set_resume(self, checkpoint):
+        """Make the next addTraces() continue from a Checkpoint instead of starting over."""
+        self._resume = checkpoint
+
+    def _save_checkpoint(self, cpa, tracerange):
+        position = min(cpa[bnum].totalTraces for bnum in self.brange)
+        subkeys = dict((bnum, cpa[bnum].get_state()) for bnum in self.brange)
+        state = AccumulatorState(__name__, [[tracerange[0], tracerange[0] + position]], self._pointRange, subkeys)
+        Checkpoint(state, tracerange, self.stats.get_state()).save(self._checkpointPath)
+
+    def set_points(self, points):
+        """Only attack some sample points (indices into the point range) from the next
+        addTraces() on: one list for all the subkeys, a dict mapping each subkey byte
+        to its list (e.g. from poi.select_points()), or None for all the samples."""
+        if isinstance(points, dict):
+            self._points = dict((bnum, np.unique(np.asarray(p, dtype=np.intp))) for (bnum, p) in points.items())
+        elif points is not None:
+            self._points = np.unique(np.asarray(points, dtype=np.intp))
+        else:
+            self._points = None
+
+    def _partition(self):
+        #Per text byte accumulation needs a leakage table, other models always accumulate per key guess
+        return self.findParam('accumulation').getValue() == 'text' and table_source(self.model) is not None
+
+    def _subkey_points(self, bnum):
+        if isinstance(self._points, dict):
+            return self._points.get(bnum)
+        return self._points
+
+    def set_early_stop(self, patience, margin=0.0, use_known_key=False):
+        """Stop attacking a subkey once it has converged, and the run once all have,
+        see ConvergenceMonitor. patience None disables early stopping."""
+        self._earlyStop = None if patience is None else (patience, margin, use_known_key)
+
+    def get_traces_to_disclosure(self):
+        """Dict mapping each subkey byte that converged in the last run to the number
+        of traces from which its best guess held (empty without early stopping)."""
+        if self._monitor is None:
+            return {}
+        return dict(self._monitor.traces_to_disclosure)
+
+    def set_history(self, recorder):
+        """Set the HistoryRecorder choosing which sumden pairs (and diffs) get stored."""
+        self._history = recorder
+
+    def get_history(self):
+        """Dict mapping each subkey byte of the last run to its SubkeyHistory."""
+        return dict((bnum, inst.history) for (bnum, inst) in enumerate(self._cpa) if inst is not None)
+
     def get_sumden_pairs(self):
         """Method to collect and return stored sumden1 and sumden2 pairs from all subkey instances."""
         sumden_pairs = []
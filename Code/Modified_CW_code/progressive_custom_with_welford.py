@@ -1,31 +1,67 @@
 import numpy as np
 from chipwhisperer.analyzer.attacks.algorithmsbase import AlgorithmsBase
+from chipwhisperer.analyzer.attacks.cpa_algorithms.leakage_tables import LeakageTable, group_sums, previous_texts
+from chipwhisperer.analyzer.attacks.cpa_algorithms.trace_batches import TraceBlockReader, previous_text
+from chipwhisperer.analyzer.attacks.cpa_algorithms.parallel_subkeys import start_subkey_pool
+from chipwhisperer.analyzer.attacks.cpa_algorithms.accumulator_state import AccumulatorState, check_mergeable
+from chipwhisperer.analyzer.attacks.cpa_algorithms.checkpoint import Checkpoint
+from chipwhisperer.analyzer.attacks.cpa_algorithms.history import HistoryRecorder
+from chipwhisperer.analyzer.attacks.cpa_algorithms.convergence import ConvergenceMonitor
+from chipwhisperer.analyzer.attacks.cpa_algorithms.poi import same_points
+
+def merge_welford(n_a, mean_a, M2_a, n_b, mean_b, M2_b):
+    """Merge two (count, mean, M2) summaries (Chan et al. parallel update).
+
+    Returns:
+        (n, mean, M2, delta) of the union, delta being mean_b - mean_a, which is
+        needed to merge co-moments: C = C_a + C_b + delta_x*delta_y*n_a*n_b/n
+    """
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    M2 = M2_a + M2_b + np.square(delta) * (n_a * n_b / n)
+    return n, mean, M2, delta
+
 
 class CPAProgressiveOneSubkey:
     """Welford‐based progressive CPA for one subkey byte."""
-    def __init__(self, model):
+    def __init__(self, model, history=None):
         self.model = model
         self.totalTraces = 0
         self.modelstate = {'knownkey': None}
+        self.leakage_table = None
+        # sample points of interest (indices into the cropped traces), None for all of them
+        self.points = None
+        # float32 batch products and cross-moments (the per-sample/per-key moments stay
+        # float64), halving the num_keys x samples accumulator. Each batch adds about
+        # 2^-24 of error to the (centered, so well conditioned) cross-moments: the
+        # correlations stay within 1e-6 of float64 (about 1e-7 after 50k traces)
+        self.single = False
+        # (textin, textout) of the trace before the next batch, for models of the
+        # previous encryption
+        self.prev_text = None
 
         # Welford for traces
         self.n_welford      = 0
         self.mean_welford   = None   # will become a vector
         self.M2_welford     = None   # Σ(t−t̄)²
 
-        # Per-key accumulators (initialized once we know trace length)
-        self.sum_cross_welford   = [None] * self.model.getPermPerSubkey()
-        self.sum_centered_hyp_sq = None
+        # Per-key accumulators, one row per key guess (initialized once we know trace length)
+        self.mean_hyp_welford    = None   # (num_keys,) h̄
+        self.sum_cross_welford   = None   # (num_keys x samples) Σ(h−h̄)(t−t̄)
+        self.sum_centered_hyp_sq = None   # (num_keys,) Σ(h−h̄)²
+
+        # bounded history of variance snapshots for the batches being recorded
+        self.history = history if history is not None else HistoryRecorder().subkey()
 
-        # Store final correlation curves
-        self.welford_diffs         = [None] * self.model.getPermPerSubkey()
-        #keep variance snapshots
-        self.stored_welford_variances = []
+    @property
+    def stored_welford_variances(self):
+        """Recorded (hyp variance, bnum, key, trace variance) tuples."""
+        return self.history.tuples()
 
     def oneSubkey(self, bnum, pointRange, traces_all, numtraces,
                   plaintexts, ciphertexts, knownkeys,
                   progressBar, state, pbcnt, accumulate_variances):
-        diffs = [0] * self.model.getPermPerSubkey()
         self.totalTraces += numtraces
 
         # 1) Crop if requested
@@ -33,82 +69,148 @@ class CPAProgressiveOneSubkey:
             traces = traces_all
         else:
             traces = traces_all[:, pointRange[0]:pointRange[1]]
+        if self.points is not None:
+            traces = traces[:, self.points]
+
+        num_keys = self.model.getPermPerSubkey()
+
+        # build hypothesized leakage of this batch for every key at once, one row per
+        # group of traces sharing it (same text byte, see LeakageTable.grouped())
+        if self.leakage_table is None:
+            self.leakage_table = LeakageTable(self.model, bnum)
+        (prev_pts, prev_cts) = self._previous_texts(plaintexts, ciphertexts)
+        (rows, inverse) = self.leakage_table.grouped(plaintexts, ciphertexts, knownkeys, state,
+                                                     prev_pts, prev_cts)
 
-        # 2) Update Welford on the new batch of traces
-        for tr in traces:
-            self.n_welford += 1
-            if self.mean_welford is None:
-                self.mean_welford = np.zeros_like(tr, dtype=np.double)
-                self.M2_welford   = np.zeros_like(tr, dtype=np.double)
-            delta = tr - self.mean_welford
-            self.mean_welford += delta / self.n_welford
-            delta2 = tr - self.mean_welford
-            self.M2_welford += delta * delta2
-        #AQUI IBA EL IF ACCUMULATE_VARIANCES AND SELF.N_WELFORD > 1
+        # 2) Init the running moments once we know the trace length
+        #    (cross-products are kept as one row per key guess)
+        if self.mean_welford is None:
+            self.mean_welford        = np.zeros(traces.shape[1], dtype=np.double)
+            self.M2_welford          = np.zeros(traces.shape[1], dtype=np.double)
+            self.mean_hyp_welford    = np.zeros(num_keys, dtype=np.double)
+            self.sum_centered_hyp_sq = np.zeros(num_keys, dtype=np.double)
+            self.sum_cross_welford   = np.zeros((num_keys, traces.shape[1]), dtype=self._cross_dtype())
+
+        # 3) Moments of this batch alone, with vectorized reductions
+        #    (float32 batch in single precision mode, the means stay float64)
+        work = self._cross_dtype()
+        if self.single:
+            traces = np.asarray(traces, dtype=work)
+        #    the hypothesis moments and cross-products are weighted sums over the groups:
+        #    Σ(h−h̄)(t−t̄) = Σ_groups (row−h̄)(Σ_group t − count·t̄)
+        (counts, sums) = group_sums(traces, inverse)
+        batch_mean_tr  = np.mean(traces, axis=0, dtype=np.double)
+        batch_mean_hyp = np.dot(counts, np.asarray(rows, dtype=np.double)) / numtraces
+        centered_tr    = traces - batch_mean_tr.astype(work)
+        centered_rows  = np.asarray(rows, dtype=work) - batch_mean_hyp.astype(work)
+        batch_M2_tr    = np.sum(np.square(centered_tr), axis=0, dtype=np.double)
+        batch_M2_hyp   = np.dot(counts, np.square(centered_rows, dtype=np.double))
+        if inverse is None:
+            centered_sums = centered_tr
+        else:
+            centered_sums = np.asarray(sums - np.outer(counts, batch_mean_tr), dtype=work)
+        # (num_keys x groups) @ (groups x samples)
+        batch_cross    = np.dot(centered_rows.T, centered_sums)
+
+        # 4) Merge the batch into the running moments (Chan et al. pairwise update)
+        n_a = self.n_welford
+        (self.n_welford, self.mean_welford, self.M2_welford, delta_tr) = merge_welford(
+            n_a, self.mean_welford, self.M2_welford, numtraces, batch_mean_tr, batch_M2_tr)
+        (_, self.mean_hyp_welford, self.sum_centered_hyp_sq, delta_hyp) = merge_welford(
+            n_a, self.mean_hyp_welford, self.sum_centered_hyp_sq, numtraces, batch_mean_hyp, batch_M2_hyp)
+        self.sum_cross_welford += batch_cross
+        self.sum_cross_welford += np.outer(delta_hyp, delta_tr) * (n_a * numtraces / self.n_welford)
+
+        # 5) Store the variances once we have ≥2 traces. The Pearson-style r (Mangard
+        #    Eq.6.2) is not computed here: correlation() is returned instead, to be
+        #    called only when the correlations are read (see Results.update_subkey())
         if accumulate_variances and self.n_welford > 1:
             var = self.M2_welford / (self.n_welford - 1)
-            
-        
-        num_keys = self.model.getPermPerSubkey()
+            hyp_ssq   = self.sum_centered_hyp_sq      # Σ(h−h̄)² per key
+            hyp_ssq_normalized = hyp_ssq / (self.n_welford - 1)
+
+            known = None
+            if self.history.recorder.keys == 'known' and len(knownkeys) > 0:
+                known = self.model.process_known_key(knownkeys[-1])[bnum]
+            self.history.record(bnum, self.n_welford, hyp_ssq_normalized, var, self.correlation, known)
+
+        # progress callback
+        pbcnt += num_keys
+        if progressBar:
+            progressBar.updateStatus(pbcnt - 1,
+              (self.totalTraces - numtraces,
+               self.totalTraces - 1,
+               bnum))
 
-        # 3) Init per-key hyp-variance arrays once
-        if self.sum_centered_hyp_sq is None:
-            self.sum_centered_hyp_sq = [
-                np.zeros_like(self.mean_welford, dtype=np.double)
-                for _ in range(num_keys)
-            ]
-
-        # 4) For each candidate key, accumulate cross‐products & hyp‐variance
-        for key in range(num_keys):
-            # build hypothesized leakage for this batch
-            hyp = np.zeros(numtraces, dtype=np.double)
-            for i in range(numtraces):
-                pt = plaintexts[i]
-                ct = ciphertexts[i]
-                nk = knownkeys[i] if knownkeys else None
-                state['knownkey'] = nk
-
-                if self.model._has_prev:
-                    hyp[i] = self.model.leakage(pt, ct, pt, ct, key, bnum, state)
-                else:
-                    hyp[i] = self.model.leakage(pt, ct, key, bnum, state)
-
-            # init cross‐product accumulator
-            if self.sum_cross_welford[key] is None:
-                self.sum_cross_welford[key] = np.zeros_like(self.mean_welford, dtype=np.double)
-
-            hyp_mean = hyp.mean()
-            centered_hyp = hyp - hyp_mean
-
-            for i, tr in enumerate(traces):
-                centered_tr = tr - self.mean_welford
-                self.sum_cross_welford[key]   += centered_hyp[i] * centered_tr
-                self.sum_centered_hyp_sq[key] += centered_hyp[i] ** 2
-
-            # 5) Compute Pearson-style r (Mangard Eq.6.2) once we have ≥2 traces
-            if self.n_welford > 1:
-                hyp_ssq   = self.sum_centered_hyp_sq[key]  # Σ(h−h̄)²
-                hyp_ssq_normalized = hyp_ssq / (self.n_welford - 1)
-                trace_ssq = self.M2_welford               # Σ(t−t̄)²
-                if accumulate_variances:
-                    self.stored_welford_variances.append((np.copy(hyp_ssq_normalized[0]), bnum, key, np.copy(var)))
-
-                denom     = np.sqrt(hyp_ssq * trace_ssq)
-                denom[denom == 0] = 1e-12
-                
-                corr      = self.sum_cross_welford[key] / denom
-                self.welford_diffs[key] = corr
-                diffs[key]             = corr
-
-            # progress callback
-            if progressBar:
-                progressBar.updateStatus(pbcnt,
-                  (self.totalTraces - numtraces,
-                   self.totalTraces - 1,
-                   bnum))
-            pbcnt += 1
-
-        return diffs, pbcnt
+        return self.correlation, pbcnt
+
+    def _previous_texts(self, plaintexts, ciphertexts):
+        """Texts of the encryption before each trace of the batch (None unless the
+        model has _has_prev), the first trace taking the last one of the previous batch."""
+        if not getattr(self.model, '_has_prev', False):
+            return (None, None)
+        last = self.prev_text if self.prev_text is not None else (None, None)
+        prev = (previous_texts(plaintexts, last[0]), previous_texts(ciphertexts, last[1]))
+        self.prev_text = (np.array(plaintexts[-1]), np.array(ciphertexts[-1]))
+        return prev
+
+    def _cross_dtype(self):
+        return np.float32 if self.single else np.double
+
+    def correlation(self):
+        """Pearson r of every key guess (num_keys x samples) from the running moments."""
+        if self.n_welford < 2:
+            return [0] * self.model.getPermPerSubkey()
+        denom = np.sqrt(np.outer(self.sum_centered_hyp_sq, self.M2_welford))
+        denom[denom == 0] = 1e-12
+        return self.sum_cross_welford / denom
+
+    def get_state(self):
+        """Return a copy of the running moments (plain numbers and numpy arrays)."""
+        state = {'n': self.n_welford}
+        if self.n_welford > 0:
+            state['mean'] = np.copy(self.mean_welford)
+            state['M2'] = np.copy(self.M2_welford)
+            state['mean_hyp'] = np.copy(self.mean_hyp_welford)
+            state['M2_hyp'] = np.copy(self.sum_centered_hyp_sq)
+            state['cross'] = np.copy(self.sum_cross_welford)
+        if self.points is not None:
+            state['points'] = np.array(self.points, dtype=np.intp)
+        return state
+
+    def set_state(self, state):
+        """Restore moments returned by get_state()."""
+        self.n_welford = int(state['n'])
+        self.totalTraces = self.n_welford
+        self.points = np.array(state['points'], dtype=np.intp) if 'points' in state else None
+        if self.n_welford > 0:
+            self.mean_welford = np.array(state['mean'], dtype=np.double)
+            self.M2_welford = np.array(state['M2'], dtype=np.double)
+            self.mean_hyp_welford = np.array(state['mean_hyp'], dtype=np.double)
+            self.sum_centered_hyp_sq = np.array(state['M2_hyp'], dtype=np.double)
+            self.sum_cross_welford = np.array(state['cross'], dtype=self._cross_dtype())
+
+    def merge_state(self, state):
+        """Merge the moments of another run over different traces (get_state() of it).
+
+        Same pairwise update as for a new batch in oneSubkey(), so the merged
+        moments are those of a single run over the traces of both."""
+        n_b = int(state['n'])
+        if n_b == 0:
+            return
+        if self.n_welford == 0:
+            self.set_state(state)
+            return
+        if not same_points(self.points, state.get('points')):
+            raise ValueError("Cannot merge moments over different points of interest")
+        n_a = self.n_welford
+        (self.n_welford, self.mean_welford, self.M2_welford, delta_tr) = merge_welford(
+            n_a, self.mean_welford, self.M2_welford, n_b, state['mean'], state['M2'])
+        (_, self.mean_hyp_welford, self.sum_centered_hyp_sq, delta_hyp) = merge_welford(
+            n_a, self.mean_hyp_welford, self.sum_centered_hyp_sq, n_b, state['mean_hyp'], state['M2_hyp'])
+        self.sum_cross_welford += state['cross']
+        self.sum_cross_welford += np.outer(delta_hyp, delta_tr) * (n_a * n_b / self.n_welford)
+        self.totalTraces = self.n_welford
 
 
 class CPAProgressiveCustom(AlgorithmsBase):
@@ -118,6 +220,16 @@ class CPAProgressiveCustom(AlgorithmsBase):
     def __init__(self):
         super().__init__()
         self.subkey_instances = []
+        self._cpa = []
+        self._traceRanges = []
+        self._pointRange = None
+        self._checkpointPath = None
+        self._checkpointEvery = 10
+        self._resume = None
+        self._history = HistoryRecorder()
+        self._earlyStop = None
+        self._monitor = None
+        self._points = None
         self.getParams().addChildren([
             {'name': 'Iteration Mode', 'key': 'itmode',
              'type': 'list',
@@ -125,6 +237,15 @@ class CPAProgressiveCustom(AlgorithmsBase):
              'value':'bf','action':self.updateScript},
             {'name': 'Skip when PGE=0', 'key':'checkpge',
              'type':'bool','value':False,'action':self.updateScript},
+            {'name': 'Prefetch Depth', 'key':'prefetch',
+             'type':'int','value':1,'limits':(0, 64),'action':self.updateScript},
+            {'name': 'Worker Processes', 'key':'workers',
+             'type':'int','value':0,'limits':(0, 256),'action':self.updateScript},
+            {'name': 'Accumulator Precision', 'key':'precision',
+             'type':'list','values':{'float64':'double','float32':'single'},
+             'value':'double','action':self.updateScript},
+            {'name': 'Reporting Stride', 'key':'stride',
+             'type':'int','value':1,'limits':(1, 1000000),'action':self.updateScript},
         ])
         self.updateScript()
 
@@ -136,42 +257,237 @@ class CPAProgressiveCustom(AlgorithmsBase):
         # one CPAProgressiveOneSubkey per byte
         cpa = [None] * (max(self.brange) + 1)
         for bnum in self.brange:
-            cpa_instance = CPAProgressiveOneSubkey(self.model)
+            cpa_instance = CPAProgressiveOneSubkey(self.model, self._history.subkey(len(self.brange)))
             cpa[bnum] = cpa_instance
             self.subkey_instances.append(cpa_instance)
+        self._cpa = cpa
+        self._traceRanges = [list(tracerange)]
+        self._pointRange = pointRange
+        single = self.findParam('precision').getValue() == 'single'
+        for bnum in self.brange:
+            cpa[bnum].points = self._subkey_points(bnum)
+            cpa[bnum].single = single
+            self.stats.set_points(bnum, cpa[bnum].points)
+
+        # continue from a checkpoint: restore the moments and results, each byte
+        # then only reads the traces it has not accumulated yet
+        if self._resume is not None:
+            resume = self._resume
+            self._resume = None
+            resume.check(__name__, tracerange, pointRange)
+            for bnum in self.brange:
+                if bnum in resume.state.subkeys:
+                    cpa[bnum].set_state(resume.state.subkeys[bnum])
+                    if not same_points(cpa[bnum].points, self._subkey_points(bnum)):
+                        raise ValueError("Checkpoint of subkey %d is over different points of interest" % bnum)
+                if cpa[bnum].totalTraces > 0:
+                    self.stats.update_subkey(bnum, cpa[bnum].correlation, tnum=cpa[bnum].totalTraces)
+            self.stats.set_state(resume.results)
+
+        # models of the previous encryption carry the texts of the last trace over
+        # from batch to batch, the first batch of each byte takes the ones of the
+        # trace before it
+        if getattr(self.model, '_has_prev', False):
+            for bnum in self.brange:
+                cpa[bnum].prev_text = previous_text(traceSource, tracerange[0] + cpa[bnum].totalTraces)
+
+        # bf specifies a 'breadth-first' search: each batch of traces is read once
+        # into a shared buffer and fed to every subkey byte before moving on.
+        # df ('depth-first') attacks each subkey completely, re-reading the
+        # traces for every byte.
+        bf = self.findParam('itmode').getValue() == 'bf'
+        if bf:
+            brange_df = [0]
+            brange_bf = self.brange
+        else:
+            brange_bf = [0]
+            brange_df = self.brange
+
+        prefetch = self.findParam('prefetch').getValue()
+
+        # worker processes attack the subkeys in parallel on each batch (always
+        # breadth-first); the pool forks, so start it before the prefetch thread
+        workers = self.findParam('workers').getValue()
+        pool = None
+        if workers > 0:
+            brange_df = [0]
+            pool = start_subkey_pool(CPAProgressiveOneSubkey, self.model, self.brange, workers,
+                                     traceSource, tracerange, pointRange, self._reportingInterval, cpa)
 
-        # breadth-first over batches
+        # early stopping, see set_early_stop(); 'Skip when PGE=0' stops each byte
+        # as soon as the known key is its best guess
+        monitor = None
+        if self._earlyStop is not None:
+            monitor = ConvergenceMonitor(*self._earlyStop)
+        elif self.findParam('checkpge').getValue():
+            monitor = ConvergenceMonitor(1, use_known_key=True)
+        self._monitor = monitor
+
+        # the callback is only called every 'Reporting Stride' batches (and after
+        # the last one); correlations are computed when the statistics are read,
+        # so batches in between only update the moments
+        stride = self.findParam('stride').getValue()
+
+        nbatch = 0
+        try:
+            for bnum_df in brange_df:
+                group = self.brange if (bf or pool is not None) else [bnum_df]
+                done = min(cpa[bnum].totalTraces for bnum in group)
+                # workers update every byte on each batch, so resuming needs them at the same trace
+                if pool is not None and any(cpa[bnum].totalTraces != done for bnum in group):
+                    raise ValueError("Cannot resume with worker processes, the subkeys of the checkpoint "
+                                     "are at different traces (resume with 'Worker Processes' = 0)")
+                reader = TraceBlockReader(traceSource, tracerange[0], numtraces, self._reportingInterval, prefetch, done)
+
+                for (tstart, tend, (traces, textins, textouts, knownkeys)) in reader:
+                    # batches to keep variances of, set by the HistoryRecorder (see set_history())
+                    accumulate_variances = self._history.wants(tstart, tend, self._reportingInterval)
+
+                    report = self.sr is not None and ((nbatch + 1) % stride == 0 or tend == numtraces)
+
+                    if pool is not None:
+                        # workers only send the correlations back when they are read
+                        want = report or monitor is not None
+                        results = pool.process(traces, textins, textouts, knownkeys, pointRange, accumulate_variances,
+                                               want)
+                        for bnum in self.brange:
+                            if want:
+                                self.stats.update_subkey(bnum, results[bnum], tnum=tend)
+                            # with worker processes bytes are not stopped one by one, only the whole run
+                            if monitor is not None:
+                                monitor.set_known_key(self.stats, self.model, knownkeys)
+                                monitor.update(self.stats, bnum, tend)
+                        pbcnt += len(self.brange) * self.model.getPermPerSubkey()
+                    else:
+                        for bnum_bf in brange_bf:
+                            bnum = bnum_bf if bf else bnum_df
+                            # skip converged bytes, and bytes that already have this batch (resuming)
+                            if monitor is not None and monitor.converged(bnum):
+                                continue
+                            if cpa[bnum].totalTraces >= tend:
+                                continue
+
+                            diffs, pbcnt = cpa[bnum].oneSubkey(
+                                bnum, pointRange,traces, tend - tstart,textins, textouts, knownkeys,progressBar, cpa[bnum].modelstate,
+                                pbcnt, accumulate_variances)
+
+                            self.stats.update_subkey(bnum, diffs, tnum=tend)
+                            if monitor is not None:
+                                monitor.set_known_key(self.stats, self.model, knownkeys)
+                                monitor.update(self.stats, bnum, cpa[bnum].totalTraces)
+
+                    # the callback may read the trace source too (e.g. known_key())
+                    stop = monitor is not None and monitor.all_converged(group)
+                    if self.sr and (report or stop):
+                        with reader.lock: self.sr()
+
+                    nbatch += 1
+                    if self._checkpointPath and nbatch % self._checkpointEvery == 0:
+                        if pool is not None:
+                            pool.snapshot(cpa)
+                        self._save_checkpoint(cpa, tracerange)
+
+                    if stop:
+                        break
+        except BaseException:
+            if pool is not None:
+                pool.terminate()
+            raise
+
+        if pool is not None:
+            pool.close(cpa)
+            for bnum in self.brange:
+                self.stats.update_subkey(bnum, cpa[bnum].correlation, tnum=cpa[bnum].totalTraces)
+        for bnum in self.brange:
+            cpa[bnum].history.flush()
+        if self._checkpointPath:
+            self._save_checkpoint(cpa, tracerange)
+
+    def get_state(self):
+        """Running moments of the last addTraces() (or merge_states()) as an AccumulatorState."""
+        subkeys = dict((bnum, inst.get_state()) for (bnum, inst) in enumerate(self._cpa) if inst is not None)
+        return AccumulatorState(__name__, self._traceRanges, self._pointRange, subkeys)
+
+    def merge_states(self, states):
+        """Merge the states of runs over disjoint trace ranges and update the statistics.
+
+        The results are those of a single run over all the traces. Call setModel()
+        and set_target_subkeys() first; subkeys missing from a state are taken
+        from the others.
+
+        Args:
+            states (list): AccumulatorState instances or paths of saved states.
+
+        Returns:
+            The merged AccumulatorState.
+        """
+        (states, trace_ranges, point_range) = check_mergeable(states, __name__)
+        cpa = [None] * (max(self.brange) + 1)
         for bnum in self.brange:
-            tstart = 0
-            tend   = self._reportingInterval
-
-            while tstart < numtraces:
-                if tend > numtraces:
-                    tend = numtraces
-
-                data, textins, textouts, knownkeys = [], [], [], []
-                for i in range(tstart, tend):
-                    tnum = i + tracerange[0]
-                    data.append(traceSource.get_trace(tnum))
-                    textins.append( traceSource.get_textin(tnum) )
-                    textouts.append(traceSource.get_textout(tnum))
-                    knownkeys.append(traceSource.get_known_key(tnum))
-
-                traces   = np.array(data)
-                textins     = np.array(textins)
-                textouts   = np.array(textouts)
-
-                accumulate_variances = (tstart >= 0 and tend <= 5000)
-
-                diffs, pbcnt = cpa[bnum].oneSubkey(
-                    bnum, pointRange,traces, tend - tstart,textins, textouts, knownkeys,progressBar, cpa[bnum].modelstate,
-                    pbcnt, accumulate_variances)
-
-                self.stats.update_subkey(bnum, diffs, tnum=tend)
-                
-                tend   += self._reportingInterval
-                tstart += self._reportingInterval
-                if self.sr: self.sr()
+            cpa[bnum] = CPAProgressiveOneSubkey(self.model)
+            cpa[bnum].single = self.findParam('precision').getValue() == 'single'
+            for state in states:
+                if bnum in state.subkeys:
+                    cpa[bnum].merge_state(state.subkeys[bnum])
+            self.subkey_instances.append(cpa[bnum])
+            self.stats.set_points(bnum, cpa[bnum].points)
+            self.stats.update_subkey(bnum, cpa[bnum].correlation, tnum=cpa[bnum].totalTraces)
+        self._cpa = cpa
+        self._traceRanges = trace_ranges
+        self._pointRange = point_range
+        return self.get_state()
+
+    def set_checkpoint(self, path, every=10):
+        """Save a Checkpoint into path every `every` batches of addTraces() and
+        when it ends. path None disables checkpointing."""
+        self._checkpointPath = path
+        self._checkpointEvery = every
+
+    def set_resume(self, checkpoint):
+        """Make the next addTraces() continue from a Checkpoint instead of starting over."""
+        self._resume = checkpoint
+
+    def _save_checkpoint(self, cpa, tracerange):
+        position = min(cpa[bnum].totalTraces for bnum in self.brange)
+        subkeys = dict((bnum, cpa[bnum].get_state()) for bnum in self.brange)
+        state = AccumulatorState(__name__, [[tracerange[0], tracerange[0] + position]], self._pointRange, subkeys)
+        Checkpoint(state, tracerange, self.stats.get_state()).save(self._checkpointPath)
+
+    def set_points(self, points):
+        """Only attack some sample points (indices into the point range) from the next
+        addTraces() on: one list for all the subkeys, a dict mapping each subkey byte
+        to its list (e.g. from poi.select_points()), or None for all the samples."""
+        if isinstance(points, dict):
+            self._points = dict((bnum, np.unique(np.asarray(p, dtype=np.intp))) for (bnum, p) in points.items())
+        elif points is not None:
+            self._points = np.unique(np.asarray(points, dtype=np.intp))
+        else:
+            self._points = None
+
+    def _subkey_points(self, bnum):
+        if isinstance(self._points, dict):
+            return self._points.get(bnum)
+        return self._points
+
+    def set_early_stop(self, patience, margin=0.0, use_known_key=False):
+        """Stop attacking a subkey once it has converged, and the run once all have,
+        see ConvergenceMonitor. patience None disables early stopping."""
+        self._earlyStop = None if patience is None else (patience, margin, use_known_key)
+
+    def get_traces_to_disclosure(self):
+        """Dict mapping each subkey byte that converged in the last run to the number
+        of traces from which its best guess held (empty without early stopping)."""
+        if self._monitor is None:
+            return {}
+        return dict(self._monitor.traces_to_disclosure)
+
+    def set_history(self, recorder):
+        """Set the HistoryRecorder choosing which variances (and diffs) get stored."""
+        self._history = recorder
+
+    def get_history(self):
+        """Dict mapping each subkey byte of the last run to its SubkeyHistory."""
+        return dict((bnum, inst.history) for (bnum, inst) in enumerate(self._cpa) if inst is not None)
 
     def get_welford_variances(self):
         vals = []
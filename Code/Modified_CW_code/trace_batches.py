@@ -0,0 +1,171 @@
+import queue
+import threading
+import numpy as np
+from chipwhisperer.common.api.TraceManager import TraceManager
+
+#THIS FILE GOES INSIDE chiswhisperer/software/chipwhisperer/analyzer/attacks/cpa_algorithms/
+#This file may be simply added to the previously mentioned directory
+
+
+def load_trace_block(traceSource, tstart, tend):
+    """Read traces [tstart, tend) of traceSource in bulk.
+
+    Trace sources providing their own get_trace_block(tstart, tend) are used
+    as-is. For a plain TraceManager the arrays of each trace segment are sliced
+    directly, so a range lying inside one segment is returned as views (no copy
+    at all when the segment is memory mapped). Anything else (e.g. preprocessing
+    modules, which transform every trace) falls back to the per-trace getters.
+
+    Args:
+        traceSource: TraceManager or other trace source to read from.
+        tstart (int): First trace number.
+        tend (int): One past the last trace number.
+
+    Returns:
+        Tuple (traces, textins, textouts, knownkeys), traces being a
+        (tend - tstart) x samples array.
+
+    Raises:
+        ValueError: If part of the range is not in the mapped trace range.
+    """
+    if hasattr(traceSource, 'get_trace_block'):
+        return traceSource.get_trace_block(tstart, tend)
+
+    if isinstance(traceSource, TraceManager):
+        return _segment_block(traceSource, tstart, tend)
+
+    data, textins, textouts, knownkeys = [], [], [], []
+    for tnum in range(tstart, tend):
+        data.append(traceSource.get_trace(tnum))
+        textins.append(traceSource.get_textin(tnum))
+        textouts.append(traceSource.get_textout(tnum))
+        knownkeys.append(traceSource.get_known_key(tnum))
+    return np.array(data), np.array(textins), np.array(textouts), knownkeys
+
+
+def previous_text(traceSource, tnum):
+    """(textin, textout) of the trace before trace tnum, or None for trace 0.
+
+    Models of the previous encryption (_has_prev) need it for the first trace
+    of a batch when a run starts (or resumes) at trace tnum.
+    """
+    if tnum <= 0:
+        return None
+    (_, textins, textouts, _) = load_trace_block(traceSource, tnum - 1, tnum)
+    return (np.array(textins[0]), np.array(textouts[0]))
+
+
+def _segment_block(traceManager, tstart, tend):
+    parts = []
+    tnum = tstart
+    while tnum < tend:
+        seg = traceManager.get_segment(tnum)
+        offset = seg.mappedRange[0]
+        stop = min(tend, seg.mappedRange[1] + 1)
+        a, b = tnum - offset, stop - offset
+
+        if getattr(seg, 'keylist', None) is not None:
+            keys = seg.keylist[a:b]
+        else:
+            keys = [seg.knownkey] * (b - a)
+        parts.append((seg.traces[a:b], np.asarray(seg.textins[a:b]), np.asarray(seg.textouts[a:b]), keys))
+        tnum = stop
+
+    if len(parts) == 1:
+        traces, textins, textouts, knownkeys = parts[0]
+        return traces, textins, textouts, knownkeys
+
+    traces = np.concatenate([p[0] for p in parts])
+    textins = np.concatenate([p[1] for p in parts])
+    textouts = np.concatenate([p[2] for p in parts])
+    knownkeys = [k for p in parts for k in p[3]]
+    return traces, textins, textouts, knownkeys
+
+
+class TraceBlockReader(object):
+    """Iterates over the reporting-interval batches of a trace range.
+
+    Yields (tstart, tend, (traces, textins, textouts, knownkeys)) with tstart
+    and tend relative to the start of the range. With depth > 0 batches are
+    loaded ahead on a worker thread into a bounded queue holding at most depth
+    batches, so reading batch k+1 overlaps with processing batch k; the
+    batches are still yielded in order. Prefetched waves are copied into memory
+    by the worker so the disk reads really happen there (also for memory-mapped
+    sources).
+
+    Anything else reading from the same trace source while iterating (e.g. a
+    stats callback calling attack.known_key()) should hold self.lock, as trace
+    managers are not thread safe.
+
+    Args:
+        traceSource: Trace source to read from.
+        offset (int): Trace number of the first trace of the range.
+        numtraces (int): Number of traces in the range.
+        interval (int): Number of traces per batch.
+        depth (int, optional): Number of batches loaded ahead. 0 reads each
+            batch when it is requested, on the calling thread.
+        tstart (int, optional): First (relative) trace to read.
+    """
+    def __init__(self, traceSource, offset, numtraces, interval, depth=0, tstart=0):
+        self.traceSource = traceSource
+        self.offset = offset
+        self.numtraces = numtraces
+        self.interval = interval
+        self.depth = depth
+        self.tstart = tstart
+        self.lock = threading.Lock()
+
+    def _ranges(self):
+        tstart = self.tstart
+        while tstart < self.numtraces:
+            yield tstart, min(tstart + self.interval, self.numtraces)
+            tstart += self.interval
+
+    def _load(self, tstart, tend):
+        with self.lock:
+            block = load_trace_block(self.traceSource, tstart + self.offset, tend + self.offset)
+        if self.depth > 0:
+            block = (np.array(block[0]),) + tuple(block[1:])
+        return block
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for (tstart, tend) in self._ranges():
+                yield tstart, tend, self._load(tstart, tend)
+            return
+
+        buffers = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    buffers.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                for (tstart, tend) in self._ranges():
+                    if not put((tstart, tend, self._load(tstart, tend))):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+
+        thread = threading.Thread(target=worker, name="TraceBlockReader", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = buffers.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            thread.join()
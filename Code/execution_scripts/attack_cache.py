@@ -0,0 +1,186 @@
+import os
+import json
+import hashlib
+import inspect
+import numpy as np
+import chipwhisperer as cw
+import chipwhisperer.analyzer as cwa
+from chipwhisperer.analyzer.attacks._stats import Results
+from chipwhisperer.analyzer.attacks.cpa_algorithms.history_export import ExportRecorder, HistoryReader
+
+# Shared driver for the graph scripts: the attack is run once per configuration and
+# its results and intermediate statistics (sumden pairs / Welford variances) are
+# kept in a cache directory, so regenerating a graph does not re-run the attack.
+
+# Bumped whenever cache_key() or the cached files change, so that older entries are not reused
+CACHE_VERSION = 3
+
+
+def _model_key(leak_model):
+    # the wrapper class (e.g. AES128_8bit or AES128_ttable, which share leakage
+    # helpers), the leakage helper and the bitmask all change the hypotheses
+    modelobj = getattr(leak_model, 'modelobj', None)
+    mask = getattr(leak_model, '_mask', None)
+    return {
+        'model': type(leak_model).__name__,
+        'modelobj': None if modelobj is None else type(modelobj).__name__,
+        'mask': None if mask is None else int(mask),
+    }
+
+
+def _algorithm_key(algorithm):
+    # the Welford engine is installed under the same module and class name as
+    # the Mangard one, so the contents of the source file tell them apart
+    with open(inspect.getsourcefile(algorithm), 'rb') as f:
+        source = hashlib.sha1(f.read()).hexdigest()
+    return {'name': algorithm.__module__ + '.' + algorithm.__name__, 'source': source}
+
+
+def cache_key(project_file, leak_model, update_interval, algorithm=None, trace_range=None, point_range=None,
+              history=None, settings=None):
+    """Everything the cached outputs depend on, as a JSON-able dict."""
+    if algorithm is None:
+        algorithm = cwa.cpa.__defaults__[0]
+    # cw.open_project() adds the extension when it is missing
+    stat = os.stat(project_file if project_file.endswith('.cwp') else project_file + '.cwp')
+    return {
+        'version': CACHE_VERSION,
+        'project': os.path.abspath(project_file),
+        'project_mtime': stat.st_mtime,
+        'project_size': stat.st_size,
+        'trace_range': None if trace_range is None else list(trace_range),
+        'point_range': None if point_range is None else list(point_range),
+        'leak_model': _model_key(leak_model),
+        'update_interval': update_interval,
+        'algorithm': _algorithm_key(algorithm),
+        'settings': settings or {},
+        'history': history or {},
+    }
+
+
+class CachedAttack(object):
+    """Outputs of one attack, read from the cache.
+
+    Attributes:
+        key (dict): Configuration of the attack, see cache_key().
+        path (str): Cache entry directory.
+        results (Results): Final results; find_maximums() and str() work as
+            after attack.run(), the diffs are memory mapped.
+        history (HistoryReader): Intermediate statistics of every batch.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'key.json')) as f:
+            self.key = json.load(f)
+        self.results = _load_results(path)
+        self.history = HistoryReader(os.path.join(path, 'history'))
+
+    def sumden_pairs(self):
+        """(sumden1, bnum, hyp, sumden2) tuples, as from get_sumden_pairs()."""
+        return self.history.tuples()
+
+    # the Welford algorithm stores (hyp_ssq_normalized, bnum, hyp, var) tuples
+    welford_variances = sumden_pairs
+
+    def __repr__(self):
+        return "CachedAttack({!r})".format(self.path)
+
+
+def _save_results(results, path):
+    results.find_maximums()
+    arrays = {'pge': np.array(results.pge, dtype=np.int64),
+              'known_key': np.array([] if results.known_key is None else list(results.known_key), dtype=np.int64),
+              'shape': np.array([results.numSubkeys, results.numPerms])}
+    for bnum in range(results.numSubkeys):
+        if results.diffs[bnum] is None:
+            continue
+        np.save(os.path.join(path, 'diffs_%02d.npy' % bnum), np.asarray(results.diffs[bnum], dtype=np.double))
+        arrays['maxes_%02d' % bnum] = results.maxes[bnum]
+        arrays['tnum_%02d' % bnum] = np.array(-1 if results.diffs_tnum[bnum] is None else results.diffs_tnum[bnum])
+    np.savez(os.path.join(path, 'results.npz'), **arrays)
+
+
+def _load_results(path):
+    with np.load(os.path.join(path, 'results.npz')) as data:
+        (numSubkeys, numPerms) = data['shape']
+        results = Results(int(numSubkeys), int(numPerms))
+        results.pge = [int(p) for p in data['pge']]
+        if len(data['known_key']) > 0:
+            results.known_key = data['known_key'].tolist()
+        for bnum in range(results.numSubkeys):
+            if 'maxes_%02d' % bnum not in data.files:
+                continue
+            results.diffs[bnum] = np.load(os.path.join(path, 'diffs_%02d.npy' % bnum), mmap_mode='r')
+            tnum = int(data['tnum_%02d' % bnum])
+            results.diffs_tnum[bnum] = None if tnum < 0 else tnum
+            results.maxes[bnum] = data['maxes_%02d' % bnum]
+            results.maxValid[bnum] = True
+    return results
+
+
+def cached_attack(project_file, leak_model=None, update_interval=100, algorithm=None, trace_range=None,
+                  point_range=None, history=None, settings=None, cache_dir=None, refresh=False):
+    """Return the outputs of an attack, running it only if they are not cached yet.
+
+    Example::
+
+        from attack_cache import cached_attack
+        run = cached_attack(project_file, cwa.leakage_models.sbox_output, 100)
+        print(run.results)
+        sumden_pairs = run.sumden_pairs()
+
+    Args:
+        project_file (str): Project to attack.
+        leak_model (optional): Leakage model, sbox_output by default.
+        update_interval (int, optional): Traces per batch (second argument of attack.run()).
+        algorithm (optional): Algorithm class given to cwa.cpa(), its default if None.
+        trace_range (list, optional): [start, end) traces, all of them if None.
+        point_range (list, optional): [start, end) sample points, all of them if None.
+        history (dict, optional): Arguments of the HistoryRecorder choosing which
+            intermediate statistics are kept (keys, points, window, stride, ...).
+        settings (dict, optional): Algorithm parameters to set, by key (e.g.
+            {'precision': 'single', 'accumulation': 'text', 'stride': 4}).
+        cache_dir (str, optional): Cache directory, "cache" in the working
+            directory by default.
+        refresh (bool, optional): Run the attack again even if it is cached.
+
+    Returns:
+        CachedAttack
+    """
+    if leak_model is None:
+        leak_model = cwa.leakage_models.sbox_output
+    if cache_dir is None:
+        cache_dir = os.path.join(os.getcwd(), "cache")
+    key = cache_key(project_file, leak_model, update_interval, algorithm, trace_range, point_range, history,
+                    settings)
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, "%s_%s" % (os.path.basename(project_file), digest))
+
+    # key.json is written last, so an interrupted run is not taken as cached
+    if not refresh and os.path.exists(os.path.join(path, 'key.json')):
+        print(f"Loading cached attack from {path}")
+        return CachedAttack(path)
+
+    print(f"Running attack, outputs cached in {path}")
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, 'key.json')):
+        os.remove(os.path.join(path, 'key.json'))
+
+    project = cw.open_project(project_file)
+    if algorithm is None:
+        attack = cwa.cpa(project, leak_model)
+    else:
+        attack = cwa.cpa(project, leak_model, algorithm)
+    if trace_range is not None:
+        attack.trace_range = list(trace_range)
+    if point_range is not None:
+        attack.point_range = list(point_range)
+    for (name, value) in (settings or {}).items():
+        attack.algorithm.findParam(name).setValue(value)
+    attack.algorithm.set_history(ExportRecorder(os.path.join(path, 'history'), **(history or {})))
+
+    results = attack.run(None, update_interval)
+    _save_results(results, path)
+    with open(os.path.join(path, 'key.json'), 'w') as f:
+        json.dump(key, f, indent=1)
+    return CachedAttack(path)
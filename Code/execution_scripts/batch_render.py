@@ -0,0 +1,111 @@
+import os
+import math
+import collections
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Headless rendering of the per-byte graphs: every figure is an object-oriented
+# matplotlib Figure drawn with the Agg canvas (no pyplot state, no window), so
+# the figures of different bytes can be rendered at the same time in a process pool.
+
+# One curve of one figure: file is the PNG name inside the output directory
+Panel = collections.namedtuple('Panel', ['bnum', 'x', 'y', 'title', 'xlabel', 'ylabel', 'marker', 'file'])
+
+
+def _draw(ax, panel, fontsize=None):
+    ax.plot(panel.x, panel.y, marker=panel.marker)
+    ax.set_title(panel.title, fontsize=fontsize)
+    ax.set_xlabel(panel.xlabel, fontsize=fontsize)
+    ax.set_ylabel(panel.ylabel, fontsize=fontsize)
+    ax.grid(True)
+
+
+def render_panel(panel, output_dir, dpi=300, figsize=(8, 4)):
+    """Render one panel to output_dir/panel.file and return its path."""
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    _draw(fig.add_subplot(1, 1, 1), panel)
+    outpath = os.path.join(output_dir, panel.file)
+    fig.savefig(outpath, dpi=dpi)
+    return outpath
+
+
+def render_overview(panels, outpath, title=None, cols=4, dpi=150):
+    """Render all panels as subplots of a single figure (one per byte) and return its path."""
+    rows = int(math.ceil(len(panels) / float(cols)))
+    fig = Figure(figsize=(4 * cols, 3 * rows))
+    FigureCanvasAgg(fig)
+    for (i, panel) in enumerate(panels):
+        ax = fig.add_subplot(rows, cols, i + 1)
+        _draw(ax, panel._replace(title="bnum %d" % panel.bnum), fontsize=8)
+        ax.tick_params(labelsize=7)
+    if title is not None:
+        fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(outpath, dpi=dpi)
+    return outpath
+
+
+def render_panels(panels, output_dir, overview=None, overview_title=None, workers=None, dpi=300, mp_context=None):
+    """Render every panel to its own PNG, plus an optional overview of all of them.
+
+    The figures are rendered in parallel by a pool of worker processes (one per
+    CPU by default). Only the panels (the x/y values of each curve) are sent to
+    the workers, so this is cheap even if the attack data is large.
+
+    Args:
+        panels (list): Panel of every byte.
+        output_dir (str): Directory for the PNGs.
+        overview (str, optional): File name of a multi-panel figure with all
+            the bytes, not rendered if None.
+        overview_title (str, optional): Title of the overview.
+        workers (int, optional): Number of processes; 1 renders in this process.
+        dpi (int, optional): Resolution of the per-byte PNGs.
+        mp_context (optional): multiprocessing context of the pool, the
+            platform default if None. With 'spawn' (the default on macOS and
+            Windows) every worker re-imports the calling script, which must
+            then only run its attack and prints under
+            if __name__ == "__main__".
+
+    Returns:
+        list of the paths written.
+    """
+    if workers == 1:
+        paths = [render_panel(panel, output_dir, dpi) for panel in panels]
+        if overview is not None:
+            paths.append(render_overview(panels, os.path.join(output_dir, overview), overview_title))
+        return paths
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        futures = [pool.submit(render_panel, panel, output_dir, dpi) for panel in panels]
+        if overview is not None:
+            futures.append(pool.submit(render_overview, panels, os.path.join(output_dir, overview), overview_title))
+        return [f.result() for f in futures]
+
+
+def batch_axis(n, update_interval, n_batches, subset_batches):
+    """X axis (traces processed) of a curve with n recorded batches, as the
+    graph scripts compute it: whole attack or [start, end) subset."""
+    if n == n_batches:
+        return [(i + 1) * update_interval for i in range(n_batches)]
+    if n == subset_batches:
+        return [(i + 1) * update_interval for i in range(subset_batches)]
+    print(f"Warning: x and y axis out of expected ranges")
+    return [(i + 1) * update_interval for i in range(n)]
+
+
+def decimate_minmax(row, width):
+    """Reduce row to at most width float32 values: the minimum and maximum of
+    every bin of consecutive samples, so that peaks survive the downsampling."""
+    row = np.asarray(row)
+    n = len(row)
+    if n <= width:
+        return row.astype(np.float32)
+    bins = max(1, width // 2)
+    starts = (np.arange(bins) * n) // bins
+    out = np.empty(2 * bins, dtype=np.float32)
+    out[0::2] = np.minimum.reduceat(row, starts)
+    out[1::2] = np.maximum.reduceat(row, starts)
+    return out
@@ -4,55 +4,19 @@ import chipwhisperer.analyzer as cwa
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+from attack_cache import cached_attack
+from batch_render import Panel, render_panels, batch_axis, decimate_minmax
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 # --- Adjust this path to your desired project file ---
 #project_file = "/Users/loredana/Desktop/TFG/attackarduino_Abraham_ECG_Malo_16_bits/attackarduino_Abraham_ECG_Malo_16_bits"
 project_file = "/Users/loredana/Desktop/TFG/randattackarduino_prueba/randattackarduino_prueba"
-print(f"Project file: {project_file}")
 project_name = os.path.basename(project_file)
 
-# Open the project
-project = cw.open_project(project_file)
-
 # Set up the CPA attack
 leak_model = cwa.leakage_models.sbox_output
-attack = cwa.cpa(project, leak_model)
-print("CPA algorithm in use:", type(attack.algorithm))
-print("Defined in file:", attack.algorithm.__class__.__module__)
 update_interval = 100
-# Run the attack
-attack_run_output = attack.run(None, update_interval)
-print("\nAttack Results (Mangard):")
-print(attack_run_output)
-
-# Retrieve the ChipWhisperer Results object that has find_maximums()
-results_obj = attack.get_statistics()  # This returns a standard 'Results' instance
-
-
-try:
-    sumden_pairs = attack.algorithm.get_sumden_pairs()
-    print("\nCustom sumden_pairs (sumden1, sumden2) retrieved from get_sumden_pairs():")
-    # Print just the first 5 for brevity
-    for i, sp in enumerate(sumden_pairs[:5]):
-        print(f"  Pair {i}: {sp}")
-except AttributeError:
-    print("\nNo 'get_sumden_pairs()' method on this attack instance.")
-    sumden_pairs = []
-    
-print("\n— Checking for get_diffs_history() method —")
-if hasattr(attack.algorithm, 'get_diffs_history'):
-    print("✓ get_diffs_history exists")
-else:
-    print("✗ No get_diffs_history() method found")
-    diffs_hist = None
-
-
-max_info =results_obj.find_maximums()
-numSubkeys = results_obj.numSubkeys
-
-# Directory for saving graphs
-output_dir = os.path.join(os.getcwd(), "graphs/Mangard")
-os.makedirs(output_dir, exist_ok=True)
 
 # If the .cfg says numTraces=1000, 5000, or 10000, set it here:
 
@@ -81,7 +45,7 @@ def save_metadata(file_path, project_file, numTraces):
 
             
 def plot_sumden1_best_guess(sumden_pairs, results_obj,
-                            update_interval, numTraces, output_dir):
+                            update_interval, numTraces, output_dir, workers=None):
 
     # 1) Find the best‐guess key for each subkey byte at the *end* of the attack
     max_info = results_obj.find_maximums()
@@ -97,32 +61,25 @@ def plot_sumden1_best_guess(sumden_pairs, results_obj,
         by_pair.setdefault((bnum, hyp), []).append(sumden1)
     
 
-    # 3) Plot, for each subkey byte, only the best‐guess curve
+    # 3) One panel per subkey byte, only the best‐guess curve
+    panels = []
     for bnum, hyp in best_hyps.items():
         y = by_pair.get((bnum, hyp), [])
-        
-        x = [(i+1)*update_interval for i in range(n_batches)] #For numTraces attack
-        
-        if len(y) != n_batches:
-            if len(y) == subset_batches:
-                x = [(i+1)*update_interval for i in range(subset_batches)] #For subTraces attack
-            elif len(y) != subset_batches:
-                print(f"Warning: x and y axis out of expected ranges")
-        
-    
-
-        plt.figure(figsize=(8,4))
-        plt.plot(x, y, marker='.')
-        plt.title(f"Hypothesis variance: sumden1 (best guess={hyp:#02x}) vs. Traces (bnum={bnum})")
-        plt.xlabel(f"Traces processed: [{start_trace_subset}, {end_trace_subset}]")
-        plt.ylabel("sumden1")
-        plt.grid(True)
-        outpath = os.path.join(output_dir ,f"sumden1_best_bnum{bnum}_{subset_batches}batches.png")
-        plt.savefig(outpath, dpi=300)
-        plt.close()
+        x = batch_axis(len(y), update_interval, n_batches, subset_batches)
+        panels.append(Panel(bnum, x, y,
+                            f"Hypothesis variance: sumden1 (best guess={hyp:#02x}) vs. Traces (bnum={bnum})",
+                            f"Traces processed: [{start_trace_subset}, {end_trace_subset}]",
+                            "sumden1", '.',
+                            f"sumden1_best_bnum{bnum}_{subset_batches}batches.png"))
+
+    # 4) Render the per-byte PNGs in parallel, plus an overview of all bytes
+    render_panels(panels, output_dir,
+                  overview=f"sumden1_best_overview_{subset_batches}batches.png",
+                  overview_title="Hypothesis variance: sumden1 (best guess) vs. Traces",
+                  workers=workers)
         
 def plot_sumden2_at_maxidx(sumden_pairs, results_obj,
-                           update_interval, numTraces, output_dir):
+                           update_interval, numTraces, output_dir, workers=None):
 
     # 1) Find, for each subkey, its max_idx (sample-point) & best hypothesis
     max_info = results_obj.find_maximums()
@@ -136,29 +93,24 @@ def plot_sumden2_at_maxidx(sumden_pairs, results_obj,
             
         by_pair.setdefault((bnum, hyp), []).append(sumden2)
 
-    # 3) Plot, for each subkey, the sumden2 at its max_idx for its best hypothesis
+    # 3) One panel per subkey, the sumden2 at its max_idx for its best hypothesis
+    panels = []
     for bnum, (hyp, max_idx) in info.items():
         vectors = by_pair.get((bnum, hyp), [])
         # extract the single sample-point from each batch
         y = [ vec[max_idx] for vec in vectors ]
-        
-        x = [(i+1)*update_interval for i in range(n_batches)] #For numTraces attack
-        if len(vectors) != n_batches:
-            if len(vectors) == subset_batches:
-                x = [(i+1)*update_interval for i in range(subset_batches)] #For subTraces attack
-            elif len(vectors) != subset_batches:
-                print(f"Warning: x and y axis out of expected ranges")
-     
-
-        plt.figure(figsize=(8,4))
-        plt.plot(x, y, marker='|')
-        plt.title(f"Trace variance: sumden2 (best guess={hyp:#02x}) vs. Traces (bnum={bnum})")
-        plt.xlabel(f"Traces processed: [{start_trace_subset}, {end_trace_subset}]")
-        plt.ylabel(f"sumden2 @ point {max_idx}")
-        plt.grid(True)
-        outpath = os.path.join(output_dir, f"sumden2_best_bnum{bnum}_{subset_batches}batches.png")
-        plt.savefig(outpath, dpi=300)
-        plt.close()
+        x = batch_axis(len(vectors), update_interval, n_batches, subset_batches)
+        panels.append(Panel(bnum, x, y,
+                            f"Trace variance: sumden2 (best guess={hyp:#02x}) vs. Traces (bnum={bnum})",
+                            f"Traces processed: [{start_trace_subset}, {end_trace_subset}]",
+                            f"sumden2 @ point {max_idx}", '|',
+                            f"sumden2_best_bnum{bnum}_{subset_batches}batches.png"))
+
+    # 4) Render the per-byte PNGs in parallel, plus an overview of all bytes
+    render_panels(panels, output_dir,
+                  overview=f"sumden2_best_overview_{subset_batches}batches.png",
+                  overview_title="Trace variance: sumden2 @ max_idx (best guess) vs. Traces",
+                  workers=workers)
         
 
 def plot_sumden2_best_and_true(sumden_pairs,
@@ -232,12 +184,21 @@ def plot_sumden2_best_and_true(sumden_pairs,
 
 def plot_sumden2_heatmap(sumden_pairs,
                           results_obj,
-                          output_dir):
+                          output_dir,
+                          history=None,
+                          width=None,
+                          dpi=300):
     """
     Generates and saves a heatmap of the final sumden2 vectors for all
     subkey bytes and their guesses, marking byte boundaries, max-correlation
     points, and coloring y-axis labels by correctness.
 
+    sumden2 only depends on the traces, so every guess of a byte has the same
+    final sumden2 vector: only one row per byte is read, decimated to the
+    output pixel width (keeping the min and max of every group of samples,
+    so peaks are not lost) and stored as float32, and it is drawn over the
+    rows of all the guesses of its byte.
+
     Encryption key is fixed:
       bytes 0–7  : subkey == 1
       bytes 8–15 : subkey == 2
@@ -245,89 +206,117 @@ def plot_sumden2_heatmap(sumden_pairs,
     Parameters
     ----------
     sumden_pairs : list of tuples
-        Each entry is (sumden1, bnum, hyp, sumden2_array) from the final batch.
+        Each entry is (sumden1, bnum, hyp, sumden2_array); only used if history is None.
     results_obj : chipwhisperer.cwa.cpa.get_statistics()
         Used to get find_maximums() info: list  (bnums [0,15])--> each a list of correlations in decreasing order for eack subkey guess [0,255]--> each a 3-tuple (guess, location, correlation).
     output_dir : str
         Directory in which to save 'sumden2_heatmap.png'.
+    history : HistoryReader, optional
+        Stored statistics (e.g. run.history of cached_attack()) to read the
+        last sumden2 row of every byte from, instead of sumden_pairs.
+    width : int, optional
+        Maximum number of sample columns, the pixel width of the figure by default.
+    dpi : int, optional
+        Resolution of the saved figure.
     """
-    # 1) Organize sumden2 arrays by (byte, hypothesis)
-    by_pair = {}
-    for _s1, bnum, hyp, s2 in sumden_pairs:
-        by_pair.setdefault((bnum, hyp), []).append(s2)
-
-    # 2) Get max_info and compute dimensions
+    # 1) Get max_info and compute dimensions
     max_info = results_obj.find_maximums()
     num_subkeys = len(max_info)       # expected 16
     guesses_per = len(max_info[0])    # expected 256
     total_rows = num_subkeys * guesses_per
+    figsize = (12, 8)
+    if width is None:
+        width = int(figsize[0] * dpi)
+
+    # 2) Final sumden2 vector of every byte
+    final = {}
+    if history is not None:
+        if history.meta['points'] is not None:
+            raise ValueError("The heatmap needs a history of every sample point")
+        for b in history.bnums:
+            if history.num_batches(b) > 0:
+                final[b] = history.trace(b, batches=[-1])[0]
+    else:
+        for _s1, bnum, hyp, s2 in sumden_pairs:
+            final[bnum] = s2
 
     # 3) Sample-point length
-    sample_len = next(iter(by_pair.values()))[-1].shape[0]
+    sample_len = len(next(iter(final.values())))
 
-    # 4) Build heatmap array
-    heatmap = np.zeros((total_rows, sample_len))
-    row = 0
+    # 4) Build heatmap array: one decimated float32 row per byte
+    rows = []
     for b in range(num_subkeys):
-        for (guess, _, _) in max_info[b]:
-            vecs = by_pair.get((b, guess), [])
-            if not vecs:
-                raise RuntimeError(f"Missing data for byte={b}, hyp={guess}")
-            heatmap[row, :] = vecs[-1]
-            row += 1
-
-    # 5) Plot heatmap
-    plt.figure(figsize=(12, 8))
-    im = plt.imshow(
+        if b not in final:
+            raise RuntimeError(f"Missing data for byte={b}")
+        rows.append(decimate_minmax(final[b], width))
+    heatmap = np.vstack(rows)
+
+    # 5) Plot heatmap, each byte row stretched over its guesses
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    im = ax.imshow(
         heatmap,
         aspect='auto',
         origin='lower',
+        interpolation='nearest',
         extent=[0, sample_len, 0, total_rows],
         cmap='viridis'
     )
-    plt.colorbar(im, label='sumden2')
-    plt.xlabel('Trace sample point index')
-    plt.ylabel('Subkey byte & guess')
-    plt.title('Heatmap of final sumden2 across all subkeys and guesses')
+    fig.colorbar(im, ax=ax, label='sumden2')
+    ax.set_xlabel('Trace sample point index')
+    ax.set_ylabel('Subkey byte & guess')
+    ax.set_title('Heatmap of final sumden2 across all subkeys and guesses')
 
     # 6) Draw byte boundaries
     for b in range(1, num_subkeys):
         y = b * guesses_per
-        plt.hlines(y, 0, sample_len, colors='white', linestyles='--', linewidth=0.5)
+        ax.hlines(y, 0, sample_len, colors='white', linestyles='--', linewidth=0.5)
 
     # 7) Mark max-correlation sample points per byte
     for b in range(num_subkeys):
         _, loc, _ = max_info[b][0]
         y0 = b * guesses_per
         y1 = y0 + guesses_per
-        plt.vlines(loc, y0, y1, colors='red', linestyles='-', linewidth=1)
+        ax.vlines(loc, y0, y1, colors='red', linestyles='-', linewidth=1)
 
     # 8) Y-axis labels: one per byte at center, colored by guess correctness
     yticks = [(b + 0.5) * guesses_per for b in range(num_subkeys)]
-    ylabels = []
+    ylabels = [f'byte {b}' for b in range(num_subkeys)]
     ground_truth = [1]*8 + [2]*8
-    for b in range(num_subkeys):
-        # determine if best guess equals ground truth
-        best_guess = max_info[b][0][0]
-        correct = (best_guess == ground_truth[b])
-        ylabels.append(f'byte {b}')
-    plt.yticks(yticks, ylabels)
+    ax.set_yticks(yticks)
+    ax.set_yticklabels(ylabels)
     # color tick labels individually
-    for tick, b in zip(plt.gca().get_yticklabels(), range(num_subkeys)):
+    for tick, b in zip(ax.get_yticklabels(), range(num_subkeys)):
         best_guess = max_info[b][0][0]
         correct = (best_guess == ground_truth[b])
         tick.set_color('black' if correct else 'red')
 
     # 9) Save figure
     outpath = os.path.join(output_dir, 'sumden2_heatmap.png')
-    plt.savefig(outpath, dpi=300)
-    plt.close()
+    fig.savefig(outpath, dpi=dpi)
     print(f"→ Saved heatmap at {outpath}")
-    plt.close()
  
 
 
 if __name__ == "__main__":
+    print(f"Project file: {project_file}")
+
+    # Run the attack, or load its results and sumden pairs from the cache
+    # (see attack_cache.py) if it already ran with this configuration
+    run = cached_attack(project_file, leak_model, update_interval)
+    print("CPA algorithm in use:", run.key['algorithm'])
+    print("\nAttack Results (Mangard):")
+    print(run.results)
+
+    # Retrieve the ChipWhisperer Results object that has find_maximums()
+    results_obj = run.results  # This is a standard 'Results' instance
+
+    sumden_pairs = run.sumden_pairs()
+    print("\nCustom sumden_pairs (sumden1, sumden2) retrieved from the cache:")
+    # Print just the first 5 for brevity
+    for i, sp in enumerate(sumden_pairs[:5]):
+        print(f"  Pair {i}: {sp}")
 
     output_dir = os.path.join(os.getcwd(), "graphs", "Mangard", project_name, f"{numTraces}_traces")
     os.makedirs(output_dir, exist_ok=True)
@@ -356,7 +345,8 @@ if __name__ == "__main__":
                                 
         plot_sumden2_heatmap(sumden_pairs,
                           results_obj,
-                          output_dir)
+                          output_dir,
+                          history=run.history)
 
         print("Done plotting sumden1 & sumden2.")
     else:
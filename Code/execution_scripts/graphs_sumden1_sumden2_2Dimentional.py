@@ -4,45 +4,15 @@ import chipwhisperer.analyzer as cwa
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+from attack_cache import cached_attack
+from batch_render import Panel, render_panels, batch_axis
 
 # --- Adjust this path to your desired project file ---
 project_file = "/Users/loredana/Desktop/TFG/randattackarduino_prueba/randattackarduino_prueba"
-print(f"Project file: {project_file}")
 project_name = os.path.basename(project_file)
 
-# Open the project
-project = cw.open_project(project_file)
-
 # Set up the CPA attack
 leak_model = cwa.leakage_models.sbox_output
-attack = cwa.cpa(project, leak_model)
-print("CPA algorithm in use:", type(attack.algorithm))
-print("Defined in file:", attack.algorithm.__class__.__module__)
-
-# Run the attack
-attack_run_output = attack.run(None, 100)
-print("\nAttack Results (Mangard):")
-print(attack_run_output)
-
-# Retrieve the ChipWhisperer Results object that has find_maximums()
-results_obj = attack.get_statistics()  # This returns a standard 'Results' instance
-
-try:
-    sumden_pairs = attack.algorithm.get_sumden_pairs()
-    print("\nCustom sumden_pairs (sumden1, sumden2) retrieved from get_sumden_pairs():")
-    # Print just the first 5 for brevity
-    for i, sp in enumerate(sumden_pairs[:5]):
-        print(f"  Pair {i}: {sp}")
-except AttributeError:
-    print("\nNo 'get_sumden_pairs()' method on this attack instance.")
-    sumden_pairs = []
-
-max_info =results_obj.find_maximums()
-numSubkeys = results_obj.numSubkeys
-
-# Directory for saving graphs
-output_dir = os.path.join(os.getcwd(), "graphs/Mangard")
-os.makedirs(output_dir, exist_ok=True)
 
 # If the .cfg says numTraces=1000, 5000, or 10000, set it here:
 
@@ -65,7 +35,7 @@ def save_metadata(file_path, project_file, numTraces):
 
             
 def plot_sumden1_best_guess(sumden_pairs, results_obj,
-                            update_interval, numTraces, output_dir):
+                            update_interval, numTraces, output_dir, workers=None):
 
     # 1) Find the best‐guess key for each subkey byte at the *end* of the attack
     max_info = results_obj.find_maximums()
@@ -87,31 +57,25 @@ def plot_sumden1_best_guess(sumden_pairs, results_obj,
     subTraces = end_trace_subset - start_trace_subset
     subset_batches = subTraces // update_interval
 
-    # 3) Plot, for each subkey byte, only the best‐guess curve
+    # 3) One panel per subkey byte, only the best‐guess curve
+    panels = []
     for bnum, hyp in best_hyps.items():
         y = by_pair.get((bnum, hyp), [])
-        
-        x = [(i+1)*update_interval for i in range(n_batches)] #For numTraces attack
-        
-        if len(y) != n_batches:
-            if len(y) == subset_batches:
-                x = [(i+1)*update_interval for i in range(subset_batches)] #For subTraces attack
-            elif len(y) != subset_batches:
-                print(f"Warning: x and y axis out of expected ranges")
-        
-    
-
-        plt.figure(figsize=(8,4))
-        plt.plot(x, y, marker='.')
-        plt.title(f"Sumden1 (best guess={hyp:#02x}) vs. Traces (bnum={bnum})")
-        plt.xlabel(f"Traces processed: [{start_trace_subset}, {end_trace_subset}]")
-        plt.ylabel("Sumden1")
-        plt.grid(True)
-        plt.savefig(f"{output_dir}/sumden1_best_bnum{bnum}_{subset_batches}batches.png", dpi=300)
-        plt.close()
+        x = batch_axis(len(y), update_interval, n_batches, subset_batches)
+        panels.append(Panel(bnum, x, y,
+                            f"Sumden1 (best guess={hyp:#02x}) vs. Traces (bnum={bnum})",
+                            f"Traces processed: [{start_trace_subset}, {end_trace_subset}]",
+                            "Sumden1", '.',
+                            f"sumden1_best_bnum{bnum}_{subset_batches}batches.png"))
+
+    # 4) Render the per-byte PNGs in parallel, plus an overview of all bytes
+    render_panels(panels, output_dir,
+                  overview=f"sumden1_best_overview_{subset_batches}batches.png",
+                  overview_title="Sumden1 (best guess) vs. Traces",
+                  workers=workers)
         
 def plot_sumden2_at_maxidx(sumden_pairs, results_obj,
-                           update_interval, numTraces, output_dir):
+                           update_interval, numTraces, output_dir, workers=None):
 
     # 1) Find, for each subkey, its max_idx (sample-point) & best hypothesis
     max_info = results_obj.find_maximums()
@@ -134,31 +98,44 @@ def plot_sumden2_at_maxidx(sumden_pairs, results_obj,
 
   
 
-    # 3) Plot, for each subkey, the sumden2 at its max_idx for its best hypothesis
+    # 3) One panel per subkey, the sumden2 at its max_idx for its best hypothesis
+    panels = []
     for bnum, (hyp, max_idx) in info.items():
         vectors = by_pair.get((bnum, hyp), [])
         # extract the single sample-point from each batch
         y = [ vec[max_idx] for vec in vectors ]
-        
-        x = [(i+1)*update_interval for i in range(n_batches)] #For numTraces attack
-        if len(vectors) != n_batches:
-            if len(vectors) == subset_batches:
-                x = [(i+1)*update_interval for i in range(subset_batches)] #For subTraces attack
-            elif len(vectors) != subset_batches:
-                print(f"Warning: x and y axis out of expected ranges")
-     
-
-        plt.figure(figsize=(8,4))
-        plt.plot(x, y, marker='|')
-        plt.title(f"Sumden2[@{max_idx}] (best guess={hyp:#02x}) vs. Traces (bnum={bnum})")
-        plt.xlabel(f"Traces processed: [{start_trace_subset}, {end_trace_subset}]")
-        plt.ylabel(f"Sumden2 @ point {max_idx}")
-        plt.grid(True)
-        plt.savefig(f"{output_dir}/sumden2_best_bnum{bnum}_{subset_batches}batches.png", dpi=300)
-        plt.close()
+        x = batch_axis(len(vectors), update_interval, n_batches, subset_batches)
+        panels.append(Panel(bnum, x, y,
+                            f"Sumden2[@{max_idx}] (best guess={hyp:#02x}) vs. Traces (bnum={bnum})",
+                            f"Traces processed: [{start_trace_subset}, {end_trace_subset}]",
+                            f"Sumden2 @ point {max_idx}", '|',
+                            f"sumden2_best_bnum{bnum}_{subset_batches}batches.png"))
+
+    # 4) Render the per-byte PNGs in parallel, plus an overview of all bytes
+    render_panels(panels, output_dir,
+                  overview=f"sumden2_best_overview_{subset_batches}batches.png",
+                  overview_title="Sumden2 @ max_idx (best guess) vs. Traces",
+                  workers=workers)
 
 
 if __name__ == "__main__":
+    print(f"Project file: {project_file}")
+
+    # Run the attack, or load its results and sumden pairs from the cache
+    # (see attack_cache.py) if it already ran with this configuration
+    run = cached_attack(project_file, leak_model, 100)
+    print("CPA algorithm in use:", run.key['algorithm'])
+    print("\nAttack Results (Mangard):")
+    print(run.results)
+
+    # Retrieve the ChipWhisperer Results object that has find_maximums()
+    results_obj = run.results  # This is a standard 'Results' instance
+
+    sumden_pairs = run.sumden_pairs()
+    print("\nCustom sumden_pairs (sumden1, sumden2) retrieved from the cache:")
+    # Print just the first 5 for brevity
+    for i, sp in enumerate(sumden_pairs[:5]):
+        print(f"  Pair {i}: {sp}")
 
     update_interval = 100       # the second arg to attack.run(...)
     output_dir = os.path.join(os.getcwd(), "graphs", "Mangard", project_name, f"{numTraces}_traces")
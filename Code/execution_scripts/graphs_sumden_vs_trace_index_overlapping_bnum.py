@@ -4,33 +4,14 @@ import chipwhisperer.analyzer as cwa
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+from attack_cache import cached_attack
 
 # Load the project file
 project_file = "/Users/loredana/Desktop/TFG/randattackarduino_prueba/randattackarduino_prueba"
 #project_file = "/Users/loredana/Desktop/TFG/attackarduino_Abraham_ECG_Malo_16_bits/attackarduino_Abraham_ECG_Malo_16_bits"
-print(project_file)
-project = cw.open_project(project_file)
 
 # Set up the CPA attack
 leak_model = cwa.leakage_models.sbox_output
-attack = cwa.cpa(project, leak_model)
-
-# Run the attack
-results = attack.run(None, 100)
-print("\nAttack Results:")
-print(results)
-
-# Retrieve stored sumden pairs for verification
-try:
-    sumden_pairs = attack.algorithm.get_sumden_pairs()
-    print("\nStored sumden pairs (sumden1, sumden2):")
-except AttributeError:
-    print("\nError: The method 'get_sumden_pairs()' does not exist in the current attack instance.")
-    sumden_pairs = []
-
-# Directory to save the graphs
-output_dir = os.path.join(os.getcwd(), "graphs")
-os.makedirs(output_dir, exist_ok=True)
 
 # Ensure numTraces aligns with the actual traces
 numTraces = 5000  # Replace this with the value from the .cfg file
@@ -125,6 +106,23 @@ def visualize_sumden_by_bnum(sumden_pairs, numTraces, project_file):
 
 
 if __name__ == "__main__":
+    print(project_file)
+
+    # Run the attack, or load its results and sumden pairs from the cache
+    # (see attack_cache.py) if it already ran with this configuration
+    run = cached_attack(project_file, leak_model, 100)
+    results = run.results
+    print("\nAttack Results:")
+    print(results)
+
+    # Retrieve stored sumden pairs for verification
+    sumden_pairs = run.sumden_pairs()
+    print("\nStored sumden pairs (sumden1, sumden2):")
+
+    # Directory to save the graphs
+    output_dir = os.path.join(os.getcwd(), "graphs")
+    os.makedirs(output_dir, exist_ok=True)
+
     # Ensure sumden_pairs is valid
     if len(sumden_pairs) > 0:
         visualize_sumden_by_bnum(sumden_pairs, numTraces, project_file)
@@ -4,51 +4,14 @@ import chipwhisperer.analyzer as cwa
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+from attack_cache import cached_attack
 
 
 project_file = "/Users/loredana/Desktop/TFG/attackarduino_Abraham_ECG_Malo_16_bits/attackarduino_Abraham_ECG_Malo_16_bits"
-print(f"Project file: {project_file}")
 project_name = os.path.basename(project_file)
 
-# Open the project
-project = cw.open_project(project_file)
-
 # Set up the CPA attack
 leak_model = cwa.leakage_models.sbox_output
-attack = cwa.cpa(project, leak_model)
-
-print("CPA algorithm in use:", type(attack.algorithm))
-print("Defined in file:", attack.algorithm.__class__.__module__)
-
-
-# Run the attack
-attack_run_output = attack.run(None, 100)
-print("\nAttack Results (Welford):")
-print(attack_run_output)
-
-# Retrieve the ChipWhisperer Results object that has find_maximums()
-results_obj = attack.get_statistics()
-max_info = results_obj.find_maximums()
-numSubkeys = results_obj.numSubkeys
-all_max_idxs = []
-for bnum in range(numSubkeys):
-    if results_obj.diffs[bnum] is None:
-        continue
-    max_idx = max_info[bnum][0][1]
-    all_max_idxs.append(max_idx)
-    
-print(f"Maximum correlation points:\n{all_max_idxs}")
-
-# Try to get Welford variances
-try:
-    welford_data = attack.algorithm.get_welford_variances()
-except AttributeError:
-    print("\nNo 'get_welford_variances()' method on this attack instance.")
-    welford_data = []
-
-# Directory for saving graphs
-output_dir = os.path.join(os.getcwd(), "graphs/welford")
-os.makedirs(output_dir, exist_ok=True)
 
 # Change according to the .cfg  numTraces value
 numTraces = 1000
@@ -112,6 +75,28 @@ def visualize_welford_variance_global(welford_data, numTraces, project_file):
     print(f"Saved global Welford variance plot: {file_path}")
 
 if __name__ == "__main__":
+    print(f"Project file: {project_file}")
+
+    # Run the attack, or load its results and variances from the cache
+    # (see attack_cache.py) if it already ran with this configuration
+    run = cached_attack(project_file, leak_model, 100)
+    print("CPA algorithm in use:", run.key['algorithm'])
+    print("\nAttack Results (Welford):")
+    print(run.results)
+
+    # Retrieve the ChipWhisperer Results object that has find_maximums()
+    results_obj = run.results
+    max_info = results_obj.find_maximums()
+    all_max_idxs = []
+    for bnum in range(results_obj.numSubkeys):
+        if results_obj.diffs[bnum] is None:
+            continue
+        all_max_idxs.append(max_info[bnum][0][1])
+    print(f"Maximum correlation points:\n{all_max_idxs}")
+
+    # Welford variances
+    welford_data = run.welford_variances()
+
     output_dir = os.path.join(os.getcwd(), "graphs", "Welford", project_name, f"{numTraces}_traces")
     os.makedirs(output_dir, exist_ok=True)
     